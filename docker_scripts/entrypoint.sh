@@ -15,6 +15,9 @@ done
 # Run database migrations
 python ./manage.py migrate
 
+# Create the report cache table, if it does not already exist
+python ./manage.py createcachetable
+
 if [ "$DJANGO_RUN_ENV" = "dev" ]; then
   # Load fixtures, only in dev environment.
   echo "Loading sample data set..."
@@ -36,6 +39,12 @@ else
   # -w number of gunicorn worker processes
   # -b IPADDR:PORT binding
   # --access-logfile where to send HTTP access logs (- is stdout)
-  export GUNICORN_CMD_ARGS="-w 3 -b 0.0.0.0:8000 --access-logfile -"
+  # -c configuration file, which cleans up metrics of exited workers
+  export GUNICORN_CMD_ARGS="-w 3 -b 0.0.0.0:8000 --access-logfile - -c docker_scripts/gunicorn.conf.py"
+  # Workers share their metrics through files in this directory, which
+  # must start out empty.
+  export PROMETHEUS_MULTIPROC_DIR=/tmp/terra_metrics
+  rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+  mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
   gunicorn proj.wsgi:application
 fi
@@ -0,0 +1,8 @@
+# Gunicorn settings read by docker_scripts/entrypoint.sh.
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker):
+    # Drop the exited worker's live metric files so that the metrics
+    # endpoint stops counting it.
+    multiprocess.mark_process_dead(worker.pid)
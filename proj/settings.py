@@ -1,3 +1,4 @@
+import ipaddress
 import locale
 import os
 
@@ -51,6 +52,8 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    "terra.middleware.MetricsMiddleware",
+    "terra.middleware.QueryProfilingMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -150,7 +153,53 @@ if os.getenv("DJANGO_RUN_ENV") != "dev":
 # Explicitly use AutoField to match the implicit Terra used in earlier Django.
 DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
 
+# Computed reports are cached in the database so that every gunicorn worker
+# shares them; see terra/cache.py. Run "manage.py createcachetable" after
+# migrating to create the table.
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "reports": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "terra_report_cache",
+        "TIMEOUT": int(os.getenv("DJANGO_REPORT_CACHE_TIMEOUT", 60 * 60 * 24)),
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+}
+
 # login redirect
 LOGIN_REDIRECT_URL = "/"
 
 INCEPTION_DATE = 2019
+
+# Read whole-fiscal-year unit, type and employee reports from the
+# EmployeeSummary table instead of the raw travel data.
+REPORTS_FROM_SUMMARY = os.getenv("DJANGO_REPORTS_FROM_SUMMARY") in ["true", "True"]
+
+# Log the SQL behind slow requests, and a sample of the rest; see
+# terra/middleware.py.
+QUERY_PROFILING = os.getenv("DJANGO_QUERY_PROFILING") in ["true", "True"]
+QUERY_PROFILING_SLOW_MS = int(os.getenv("DJANGO_QUERY_PROFILING_SLOW_MS", 1000))
+QUERY_PROFILING_SAMPLE_RATE = float(
+    os.getenv("DJANGO_QUERY_PROFILING_SAMPLE_RATE", 0.01)
+)
+
+# Serve request, SQL, report cache and export metrics at /metrics to the
+# listed addresses or networks; see terra/metrics.py.
+METRICS = os.getenv("DJANGO_METRICS") in ["true", "True"]
+METRICS_ALLOWED_IPS = [
+    ipaddress.ip_network(network.strip(), strict=False)
+    for network in os.getenv("DJANGO_METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",")
+    if network.strip()
+]
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "terra": {
+            "handlers": ["console"],
+            "level": os.getenv("DJANGO_LOG_LEVEL") or "INFO",
+        },
+    },
+}
@@ -19,7 +19,9 @@ from terra.views import (
     ActualExpenseExportView,
     UnitOrgExportView,
     EmployeeDetailExportView,
+    DiagnosticsView,
     home,
+    metrics,
 )
 
 urlpatterns = [
@@ -144,5 +146,11 @@ urlpatterns = [
         ActualExpenseExportView.as_view(),
         name="actual_expense_report_csv",
     ),
+    path(
+        "diagnostics/",
+        DiagnosticsView.as_view(template_name="terra/diagnostics.html"),
+        name="diagnostics",
+    ),
+    path("metrics", metrics, name="metrics"),
     path("", home, name="home"),
 ]
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.db.models import Count
 
 
 from .models import (
@@ -12,6 +13,7 @@ from .models import (
     Funding,
     ActualExpense,
 )
+from .utils import format_currency
 
 
 def custom_titled_filter(title):
@@ -56,12 +58,32 @@ class ActualExpenseInline(admin.TabularInline):
     autocomplete_fields = ["fund"]
 
 
+@admin.display(
+    description="Employee count",
+    ordering="employee_total"
+)
+def employee_count(obj):
+    return obj.employee_total
+
+
+
+
 @admin.register(Unit)
 class UnitAdmin(admin.ModelAdmin):
-    list_display = ("name", "manager", "employee_count", "parent_unit")
+    list_display = ("name", "manager", employee_count, "parent_unit")
     list_filter = (("parent_unit", custom_titled_filter("parent unit")),)
     search_fields = ["name"]
     autocomplete_fields = ["manager", "parent_unit"]
+    # Grouped queries drop Meta.ordering; keep the autocomplete sorted.
+    ordering = ("name",)
+
+    def get_queryset(self, request):
+        return (
+            super()
+            .get_queryset(request)
+            .select_related("manager", "parent_unit")
+            .annotate(employee_total=Count("employee"))
+        )
 
 
 @admin.register(Employee)
@@ -78,9 +100,13 @@ class EmployeeAdmin(admin.ModelAdmin):
     )
     list_display_links = ("uid", "name")
     list_filter = ("active", "type")
-    search_fields = ["user__last_name", "user__first_name", "unit__name"]
+    search_fields = ["display_name", "unit__name"]
     autocomplete_fields = ["supervisor", "unit", "user"]
 
+    def get_queryset(self, request):
+        # Also used for the employee autocomplete lookups.
+        return super().get_queryset(request).select_related("unit", "supervisor")
+
 
 # Functions to rename travelrequest list columns
 @admin.display(
@@ -93,19 +119,32 @@ def days_ooo(obj):
 
 
 @admin.display(
-    description="Funding"
+    description="Funding",
+    ordering="funding_total"
 )
 def approved_total(obj):
-    return obj.approved_total()
+    return format_currency(obj.funding_total)
 
 
 
 
 @admin.display(
-    description="Actual"
+    description="Actual",
+    ordering="expense_total"
 )
 def expenditures_total(obj):
-    return obj.expenditures_total()
+    return format_currency(obj.expense_total)
+
+
+
+
+@admin.display(
+    boolean=True,
+    description="Funded",
+    ordering="funding_total"
+)
+def funded(obj):
+    return obj.funding_total > 0
 
 
 
@@ -121,7 +160,7 @@ class TravelRequestAdmin(admin.ModelAdmin):
         "administrative",
         "canceled",
         "approved",
-        "funded",
+        funded,
         "closed",
         approved_total,
         expenditures_total,
@@ -135,13 +174,19 @@ class TravelRequestAdmin(admin.ModelAdmin):
         "canceled",
     )
     search_fields = [
-        "traveler__user__last_name",
-        "traveler__user__first_name",
+        "traveler__display_name",
         "activity__name",
     ]
     autocomplete_fields = ["activity", "approved_by", "traveler"]
     inlines = (FundingInline, ActualExpenseInline)
 
+    def get_queryset(self, request):
+        # Load each row's traveler and activity with the page itself instead
+        # of one query per row; the totals are stored on the request.
+        return (
+            super().get_queryset(request).select_related("traveler", "activity")
+        )
+
 
 @admin.register(Activity)
 class ActivityAdmin(admin.ModelAdmin):
@@ -164,8 +209,7 @@ class VacationAdmin(admin.ModelAdmin):
         ("end", custom_titled_filter("end date")),
     )
     search_fields = [
-        "treq__traveler__user__last_name",
-        "treq__traveler__user__first_name",
+        "treq__traveler__display_name",
         "treq__activity__name",
     ]
     autocomplete_fields = ["treq"]
@@ -178,8 +222,7 @@ class FundAdmin(admin.ModelAdmin):
         "account",
         "cost_center",
         "fund",
-        "manager__user__last_name",
-        "manager__user__first_name",
+        "manager__display_name",
     ]
     autocomplete_fields = ["manager"]
 
@@ -189,8 +232,7 @@ class FundingAdmin(admin.ModelAdmin):
     list_display = ("id", "treq", "fund", "funded_by", "funded_on", "amount")
     list_filter = ("fund", ("funded_on", custom_titled_filter("funding date")))
     search_fields = [
-        "treq__traveler__user__last_name",
-        "treq__traveler__user__first_name",
+        "treq__traveler__display_name",
         "treq__activity__name",
     ]
     autocomplete_fields = ["funded_by", "fund", "treq"]
@@ -201,8 +243,7 @@ class ActualExpenseAdmin(admin.ModelAdmin):
     list_display = ("id", "treq", "fund", "type", "total_dollars", "date_paid")
     list_filter = ("type", "fund")
     search_fields = [
-        "treq__traveler__user__last_name",
-        "treq__traveler__user__first_name",
+        "treq__traveler__display_name",
         "treq__activity__name",
     ]
     autocomplete_fields = ["fund", "treq"]
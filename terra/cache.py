@@ -0,0 +1,70 @@
+import hashlib
+import time
+
+from django.core.cache import caches
+
+from .metrics import REPORT_CACHE_LOOKUPS
+
+# Reports are cached per (report type, subject, fiscal-year range). Writes
+# never delete entries: they replace the generation stamp of every
+# (subject, fiscal year) they feed into, and those generations are part of
+# each report's key, so superseded entries are never read again and simply
+# age out. Subjects are "all", "unit:<id>" and "fund:<id>"; the "org"
+# generation covers changes to the organization itself (units, employees,
+# funds) and is part of every key.
+REPORT_CACHE = "reports"
+MISSING = object()
+
+
+def report_cache():
+    return caches[REPORT_CACHE]
+
+
+def generation_keys(subject, start_year, end_year):
+    keys = [f"gen:{subject}:{year}" for year in range(start_year, end_year + 1)]
+    keys.append("gen:org")
+    return keys
+
+
+def get_generations(keys):
+    cache = report_cache()
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            # Seed from the clock rather than 0 so that a counter evicted
+            # from the cache can never come back at a value it had before.
+            cache.add(key, time.time_ns(), timeout=None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def bump_generations(keys):
+    # A fresh value needs no read, so concurrent writers cannot lose a bump.
+    report_cache().set_many({key: time.time_ns() for key in keys}, timeout=None)
+
+
+def report_key(kind, subject, start_year, end_year):
+    start_year, end_year = int(start_year), int(end_year)
+    generations = get_generations(generation_keys(subject, start_year, end_year))
+    digest = hashlib.md5(
+        ".".join(str(g) for g in generations).encode(), usedforsecurity=False
+    ).hexdigest()
+    return f"report:{kind}:{subject}:{start_year}-{end_year}:{digest}"
+
+
+def cached_report(kind, subject, start_year, end_year, compute):
+    """
+    Returns the cached result of compute() for this report, computing and
+    storing it on a miss.
+    """
+    cache = report_cache()
+    key = report_key(kind, subject, start_year, end_year)
+    value = cache.get(key, MISSING)
+    # Counted per worker for the metrics endpoint, which adds the workers up.
+    if value is MISSING:
+        REPORT_CACHE_LOOKUPS.labels("miss").inc()
+        value = compute()
+        cache.set(key, value)
+    else:
+        REPORT_CACHE_LOOKUPS.labels("hit").inc()
+    return value
@@ -0,0 +1,68 @@
+import timeit
+from datetime import date, timedelta
+
+import fiscalyear as FY
+from django.core.management.base import BaseCommand, CommandError
+from terra import utils
+
+
+def library_fiscal_year(day):
+    return FY.FiscalDate(day.year, day.month, day.day).fiscal_year
+
+
+def library_bookends(year):
+    fy = FY.FiscalYear(year)
+    return (fy.start.date(), fy.end.date())
+
+
+def library_in_fiscal_year(dates, year):
+    return [library_fiscal_year(d) == year for d in dates]
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the fiscal-year helpers in terra.utils against the equivalent "
+        "fiscalyear library calls"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--number", type=int, default=10000, help="Calls per timing (10000)"
+        )
+
+    def handle(self, *args, **options):
+        number = options["number"]
+        dates = [date(2015, 1, 1) + timedelta(days=n) for n in range(3650)]
+        day = date(2020, 3, 15)
+        cases = [
+            (
+                "current_fiscal_year",
+                lambda: library_fiscal_year(day),
+                lambda: utils.current_fiscal_year(today=day),
+                number,
+            ),
+            (
+                "fiscal_year_bookends",
+                lambda: library_bookends(2020),
+                lambda: utils.fiscal_year_bookends(2020),
+                number,
+            ),
+            (
+                f"in_fiscal_year x {len(dates)}",
+                lambda: library_in_fiscal_year(dates, 2020),
+                lambda: utils.dates_in_fiscal_year(dates, 2020),
+                max(number // len(dates), 1),
+            ),
+        ]
+        self.stdout.write(
+            f"{'':32}{'fiscalyear':>14}{'terra.utils':>14}{'speedup':>10}"
+        )
+        for name, library, ours, calls in cases:
+            if library() != ours():
+                raise CommandError(f"{name}: terra.utils disagrees with fiscalyear")
+            before = timeit.timeit(library, number=calls) / calls
+            after = timeit.timeit(ours, number=calls) / calls
+            self.stdout.write(
+                f"{name:32}{before * 1e6:>12.2f}us{after * 1e6:>12.2f}us"
+                f"{before / after:>9.1f}x"
+            )
@@ -0,0 +1,319 @@
+import json
+import time
+import tracemalloc
+from datetime import datetime
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.test import Client, override_settings
+from terra import reports, synthetic
+from terra.models import Employee, Fund, TravelRequest, Unit
+from terra.utils import current_fiscal_year, fiscal_year_bookends
+
+# Reports are measured uncached unless --cached is given.
+NO_REPORT_CACHE = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "reports": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+}
+
+
+# Smaller differences than these are within run-to-run noise.
+NOISE = {"p50_ms": 2.0, "peak_kib": 16.0}
+
+
+class Rollback(Exception):
+    pass
+
+
+def percentile(values, fraction):
+    """
+    Returns the nearest-rank percentile of values.
+    """
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+class QueryTimer:
+    """
+    Database execute wrapper that counts queries and adds up their time.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.seconds += time.perf_counter() - started
+
+
+def measure(run, iterations):
+    """
+    Calls run() iterations times and returns its query count, SQL time,
+    wall-clock p50/p95 and peak Python memory.
+    """
+    run()  # Warm up imports, templates and the ORM's caches.
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    times, sql_times, queries = [], [], 0
+    for i in range(iterations):
+        timer = QueryTimer()
+        with connection.execute_wrapper(timer):
+            started = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - started)
+        queries = timer.queries
+        sql_times.append(timer.seconds)
+    return {
+        "queries": queries,
+        "sql_ms": round(percentile(sql_times, 0.5) * 1000, 2),
+        "p50_ms": round(percentile(times, 0.5) * 1000, 2),
+        "p95_ms": round(percentile(times, 0.95) * 1000, 2),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def benchmark_cases(start_year, end_year):
+    """
+    Returns (name, callable) for each report function and view, run on
+    the library, its busiest fund and its busiest traveler.
+    """
+    start_date = fiscal_year_bookends(start_year)[0]
+    end_date = fiscal_year_bookends(end_year)[1]
+    years = f"{start_year}-{end_year}"
+    unit = Unit.objects.filter(parent_unit=None).order_by("lft").first()
+    if unit is None:
+        raise CommandError("No units to report on; load or generate some data")
+    employee_ids = list(Employee.objects.values_list("id", flat=True))
+    fund = (
+        Fund.objects.annotate(n=Count("funding")).order_by("-n").first()
+        or Fund.objects.first()
+    )
+    traveler = (
+        Employee.objects.annotate(n=Sum("travelrequest__days_ooo"))
+        .order_by(F("n").desc(nulls_last=True), "id")
+        .first()
+    )
+    treq_ids = list(
+        TravelRequest.objects.filter(traveler=traveler).values_list("id", flat=True)
+    )
+
+    client = Client()
+    client.force_login(benchmark_user(unit))
+
+    def get(url):
+        def run():
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f"GET {url} returned {response.status_code}")
+            return response.content
+
+        return run
+
+    cases = [
+        ("unit_report", lambda: reports.unit_report(unit, start_date, end_date)),
+        (
+            "unit_tree_report",
+            lambda: reports.unit_tree_report(unit, start_date, end_date),
+        ),
+        (
+            "merge_data_type",
+            lambda: reports.merge_data_type(employee_ids, start_date, end_date),
+        ),
+        (
+            "employee_total_report",
+            lambda: reports.employee_total_report(employee_ids, start_date, end_date),
+        ),
+        (
+            "get_individual_data_treq",
+            lambda: list(
+                reports.get_individual_data_treq(treq_ids, start_date, end_date)
+            ),
+        ),
+        (
+            "employee_treq_rows",
+            lambda: reports.employee_treq_rows(traveler, start_date, end_date),
+        ),
+        ("view unit_list", get("/unit/")),
+        ("view unit_detail", get(f"/unit/{unit.pk}/{years}/")),
+        ("view unit_csv", get(f"/unit/{unit.pk}/{years}/export/")),
+        ("view org_csv", get(f"/unit/{unit.pk}/{years}/org_export/")),
+        ("view employee_detail", get(f"/employee/{traveler.pk}/{years}/")),
+        ("view employee_detail_csv", get(f"/employee/{traveler.pk}/{years}/export/")),
+        ("view employee_type_list", get(f"/employee_type_list/{years}/")),
+        ("view employee_type_csv", get(f"/employee_type_list/{years}/export/")),
+        ("view actual_expense_report", get(f"/actual_expense_report/{years}/")),
+        (
+            "view actual_expense_report_csv",
+            get(f"/actual_expense_report/{years}/export/"),
+        ),
+    ]
+    if fund is not None:
+        cases += [
+            ("fund_report", lambda: reports.fund_report(fund, start_date, end_date)),
+            ("view fund_detail", get(f"/fund/{fund.pk}/{years}/")),
+            ("view fund_csv", get(f"/fund/{fund.pk}/{years}/export/")),
+        ]
+    return cases
+
+
+def benchmark_user(unit):
+    """
+    Returns a superuser with an employee record to request the views as.
+    Created inside the benchmark's transaction, so it is rolled back.
+    """
+    user = User.objects.create_superuser("benchmark-reports", password=None)
+    Employee.objects.create(user=user, unit=unit, uid="BENCHMARK")
+    return user
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns a line per case comparing results with the baseline, and the
+    names of the cases that regressed.
+    """
+    lines, regressions = [], []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            lines.append(f"{name:34} new")
+            continue
+        worse = []
+        if result["queries"] > before["queries"]:
+            worse.append(f"queries {before['queries']} -> {result['queries']}")
+        for metric, noise in NOISE.items():
+            if result[metric] > max(
+                before[metric] * (1 + threshold), before[metric] + noise
+            ):
+                worse.append(f"{metric} {before[metric]} -> {result[metric]}")
+        change = result["p50_ms"] / before["p50_ms"] - 1 if before["p50_ms"] else 0
+        status = "REGRESSION " + ", ".join(worse) if worse else "ok"
+        lines.append(f"{name:34} p50 {change:+.0%}  {status}")
+        if worse:
+            regressions.append(name)
+    return lines, regressions
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the reports and report views, and compare the results with a "
+        "saved baseline. Changes are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--start-year",
+            type=int,
+            default=current_fiscal_year(),
+            help="First fiscal year of the reports (default: current)",
+        )
+        parser.add_argument(
+            "--end-year",
+            type=int,
+            default=current_fiscal_year(),
+            help="Last fiscal year of the reports (default: current)",
+        )
+        parser.add_argument(
+            "--iterations", type=int, default=10, help="Timed runs per case (10)"
+        )
+        parser.add_argument(
+            "--case",
+            action="append",
+            help="Only run cases whose name contains this; may be repeated",
+        )
+        parser.add_argument(
+            "--synthetic",
+            type=int,
+            metavar="TREQS",
+            help="Benchmark a synthetic dataset of this many travel requests "
+            "instead of the existing data",
+        )
+        parser.add_argument(
+            "--cached",
+            action="store_true",
+            help="Keep the report cache, measuring cache hits",
+        )
+        parser.add_argument("--output", help="Write the results to this JSON file")
+        parser.add_argument(
+            "--baseline", help="Compare with the results in this JSON file"
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.2,
+            help="Slowdown or memory growth that counts as a regression (0.2)",
+        )
+
+    def handle(self, *args, **options):
+        results = {}
+        settings = {"ALLOWED_HOSTS": ["*"]}
+        if not options["cached"]:
+            settings["CACHES"] = NO_REPORT_CACHE
+        try:
+            with override_settings(**settings), transaction.atomic():
+                if options["synthetic"]:
+                    counts = synthetic.generate(
+                        units=max(10, options["synthetic"] // 500),
+                        employees=max(50, options["synthetic"] // 20),
+                        treqs=options["synthetic"],
+                    )
+                    self.stdout.write(f"Synthetic dataset: {counts}")
+                rows = {
+                    "employees": Employee.objects.count(),
+                    "treqs": TravelRequest.objects.count(),
+                }
+                cases = benchmark_cases(options["start_year"], options["end_year"])
+                if options["case"]:
+                    cases = [
+                        (name, run)
+                        for name, run in cases
+                        if any(part in name for part in options["case"])
+                    ]
+                for name, run in cases:
+                    results[name] = measure(run, options["iterations"])
+                    self.stdout.write(
+                        "{:34}{queries:>5} queries {sql_ms:>9.1f}ms SQL "
+                        "p50 {p50_ms:>9.1f}ms p95 {p95_ms:>9.1f}ms "
+                        "{peak_kib:>10.1f}KiB".format(name, **results[name])
+                    )
+                raise Rollback
+        except Rollback:
+            pass
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(
+                    {
+                        "run": {
+                            "date": datetime.now().isoformat(timespec="seconds"),
+                            "database": connection.vendor,
+                            "start_year": options["start_year"],
+                            "end_year": options["end_year"],
+                            "iterations": options["iterations"],
+                            "cached": options["cached"],
+                            **rows,
+                        },
+                        "results": results,
+                    },
+                    f,
+                    indent=2,
+                )
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)["results"]
+            lines, regressions = compare(results, baseline, options["threshold"])
+            self.stdout.write("")
+            self.stdout.write(f"Compared with {options['baseline']}:")
+            for line in lines:
+                self.stdout.write(line)
+            if regressions:
+                raise CommandError(f"{len(regressions)} regression(s)")
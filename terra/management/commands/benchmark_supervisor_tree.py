@@ -0,0 +1,136 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from terra import synthetic
+from terra.models import Employee, EmployeeClosure
+
+
+class Rollback(Exception):
+    pass
+
+
+def recursive_full_team(employee):
+    # Employee.full_team before the closure table: a query per employee.
+    staff = [employee]
+    managers = []
+    direct_reports = employee.direct_reports()
+    if len(direct_reports) > 0:
+        managers.append(employee)
+        for e in direct_reports:
+            substaff, submgrs = recursive_full_team(e)
+            staff.extend(substaff)
+            managers.extend(submgrs)
+    return staff, managers
+
+
+def walk_supervisors(employee):
+    # Fund.super_managers before the closure table: a query per level.
+    chain = [employee]
+    while chain[-1].supervisor_id is not None:
+        chain.append(Employee.objects.get(pk=chain[-1].supervisor_id))
+    return chain
+
+
+def ids(employees):
+    return [e.id for e in employees]
+
+
+def measure(run, number):
+    """
+    Returns run()'s result and query count, and its mean time over number
+    further calls.
+    """
+    with CaptureQueriesContext(connection) as queries:
+        result = run()
+    started = time.perf_counter()
+    for i in range(number):
+        run()
+    return result, len(queries), (time.perf_counter() - started) / number
+
+
+class Command(BaseCommand):
+    help = (
+        "Time full_team, supervisor_chain and supervisor changes on a "
+        "synthetic supervisor tree, against the recursive walks the closure "
+        "table replaced. Changes are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--employees", type=int, default=5000, help="Size of the tree (5000)"
+        )
+        parser.add_argument(
+            "--fanout", type=int, default=6, help="Reports per supervisor (6)"
+        )
+        parser.add_argument(
+            "--number", type=int, default=3, help="Timed runs per case (3)"
+        )
+
+    def handle(self, *args, **options):
+        if options["fanout"] < 2 or options["employees"] <= options["fanout"] + 1:
+            raise CommandError("Need a fanout of 2 or more and three levels")
+        try:
+            with transaction.atomic():
+                self.benchmark(
+                    options["employees"], options["fanout"], options["number"]
+                )
+                raise Rollback
+        except Rollback:
+            pass
+
+    def benchmark(self, count, fanout, number):
+        levels = synthetic.build_supervisor_tree(count, fanout)
+        root, leaf = levels[0][0], levels[-1][-1]
+        self.stdout.write(
+            f"{count} employees, fanout {fanout}, {len(levels)} levels, "
+            f"{connection.vendor}"
+        )
+        self.stdout.write(f"{'':28}{'recursive':>27}{'closure':>27}{'speedup':>10}")
+        cases = [
+            (
+                "full_team from the root",
+                lambda: [ids(part) for part in recursive_full_team(root)],
+                lambda: [ids(part) for part in root.full_team()],
+            ),
+            (
+                f"supervisor_chain, {len(levels)} deep",
+                lambda: ids(walk_supervisors(leaf)),
+                lambda: ids(leaf.supervisor_chain()),
+            ),
+        ]
+        for name, before, after in cases:
+            old, old_queries, old_time = measure(before, number)
+            new, new_queries, new_time = measure(after, number)
+            if old != new:
+                raise CommandError(f"{name}: the closure table disagrees")
+            self.stdout.write(
+                f"{name:28}{old_queries:>8} queries {old_time * 1000:>8.1f}ms"
+                f"{new_queries:>8} queries {new_time * 1000:>8.1f}ms"
+                f"{old_time / new_time:>9.1f}x"
+            )
+
+        # Move a mid-level supervisor, and their reports, back and forth
+        # between two supervisors on the level above.
+        middle = max(2, len(levels) // 2)
+        moved = levels[middle][0]
+        targets = [moved.supervisor, levels[middle - 1][-1]]
+
+        def move():
+            moved.supervisor = targets[moved.supervisor == targets[0]]
+            moved.save()
+
+        _, queries, seconds = measure(move, number)
+        self.stdout.write(
+            f"{'moving a subtree':28}{'':27}{queries:>8} queries "
+            f"{seconds * 1000:>8.1f}ms"
+        )
+        links = set(
+            EmployeeClosure.objects.values_list("ancestor", "descendant", "depth")
+        )
+        EmployeeClosure.rebuild()
+        if links != set(
+            EmployeeClosure.objects.values_list("ancestor", "descendant", "depth")
+        ):
+            raise CommandError("moving a subtree: the closure table disagrees")
@@ -0,0 +1,167 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from terra import reports, synthetic
+from terra.models import ActualExpense, Employee, Fund, Funding, TravelRequest, Unit
+from terra.utils import current_fiscal_year, fiscal_year_bookends
+
+
+class Rollback(Exception):
+    pass
+
+
+def report_queries(fiscal_year):
+    """
+    Returns (name, queryset) for the queries behind the unit, fund and
+    employee reports, using the largest division, fund and traveler.
+    """
+    start_date, end_date = fiscal_year_bookends(fiscal_year)
+    unit = (
+        Unit.objects.filter(type="2")
+        .annotate(n=Count("descendant_links__descendant__employee"))
+        .order_by("-n")
+        .first()
+    ) or Unit.objects.filter(parent_unit=None).first()
+    if unit is None:
+        raise CommandError("No units to report on; load or generate some data")
+    employee_ids = list(
+        Employee.objects.filter(unit__ancestor_links__ancestor=unit).values_list(
+            "id", flat=True
+        )
+    )
+    if not employee_ids:
+        raise CommandError(f"{unit} has no employees to report on")
+    fund = Fund.objects.annotate(n=Count("funding")).order_by("-n").first()
+    traveler = (
+        TravelRequest.objects.values_list("traveler", flat=True)
+        .annotate(n=Count("id"))
+        .order_by("-n")
+        .first()
+    )
+    queries = [
+        (
+            f"{ledger} ledger ({unit}, {len(employee_ids)} employees)",
+            reports.get_ledger(ledger, employee_ids, start_date, end_date).annotate(
+                n=Count("pk")
+            ),
+        )
+        for ledger in ("funding", "actualexpense", "travelrequest", "vacation")
+    ]
+    if fund is not None:
+        treq_ids = list(reports.get_treq_list(fund, start_date, end_date))
+        fund_employees = list(reports.get_fund_employee_list(fund))
+        queries += [
+            (
+                f"fund {fund} funding",
+                Funding.objects.filter(
+                    reports.treq_in_window(start_date, end_date, "treq__"), fund=fund
+                ).values("treq"),
+            ),
+            (
+                f"fund {fund} expenses",
+                ActualExpense.objects.filter(
+                    reports.paid_in_window(start_date, end_date), fund=fund
+                ).values("treq"),
+            ),
+        ]
+        # Django skips queries on an empty id list, leaving nothing to explain.
+        if treq_ids:
+            queries.append(
+                (
+                    f"fund {fund} travel requests",
+                    reports.get_individual_data_for_treq(
+                        treq_ids, fund, start_date, end_date
+                    ),
+                )
+            )
+        if fund_employees:
+            queries.append(
+                (
+                    f"fund {fund} employees",
+                    reports.get_individual_data_for_fund(
+                        fund_employees, fund, start_date, end_date
+                    ),
+                )
+            )
+    if traveler is not None:
+        queries.append(
+            (
+                f"employee {traveler} travel requests",
+                reports.annotate_treq_data(
+                    TravelRequest.objects.filter(traveler=traveler),
+                    start_date,
+                    end_date,
+                ),
+            )
+        )
+    return queries
+
+
+def report_indexes():
+    """
+    Returns the report indexes declared in Meta.indexes.
+    """
+    return [
+        index
+        for model in (TravelRequest, Funding, ActualExpense)
+        for index in model._meta.indexes
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Print the query plans of the report queries with and without the "
+        "report indexes. Changes are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fiscal-year",
+            type=int,
+            default=current_fiscal_year(),
+            help="Fiscal year to report on (default: current)",
+        )
+        parser.add_argument(
+            "--synthetic",
+            type=int,
+            metavar="TREQS",
+            help="Explain against a synthetic dataset of this many travel "
+            "requests instead of the existing data",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options["synthetic"]:
+                    counts = synthetic.generate(
+                        units=max(10, options["synthetic"] // 500),
+                        employees=max(50, options["synthetic"] // 20),
+                        treqs=options["synthetic"],
+                    )
+                    self.stdout.write(f"Synthetic dataset: {counts}")
+                self.analyze()
+                after = self.explain(options["fiscal_year"])
+                with connection.cursor() as cursor:
+                    for index in report_indexes():
+                        cursor.execute(
+                            f"DROP INDEX {connection.ops.quote_name(index.name)}"
+                        )
+                self.analyze()
+                before = self.explain(options["fiscal_year"])
+                raise Rollback
+        except Rollback:
+            pass
+        for name, plan in before:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write("Without report indexes:")
+            self.stdout.write(plan)
+            self.stdout.write("With report indexes:")
+            self.stdout.write(dict(after)[name])
+            self.stdout.write("")
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def explain(self, fiscal_year):
+        return [(name, qs.explain()) for name, qs in report_queries(fiscal_year)]
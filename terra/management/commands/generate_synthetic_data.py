@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand
+from terra.synthetic import generate
+
+
+class Command(BaseCommand):
+    help = (
+        "Add a synthetic organization and its travel data, for trying the "
+        "reports at production scale"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--units", type=int, default=50, help="Number of units (50)"
+        )
+        parser.add_argument(
+            "--levels", type=int, default=3, help="Levels of units below the root (3)"
+        )
+        parser.add_argument(
+            "--employees", type=int, default=500, help="Number of employees (500)"
+        )
+        parser.add_argument(
+            "--funds", type=int, default=20, help="Number of funds (20)"
+        )
+        parser.add_argument(
+            "--years",
+            type=int,
+            default=3,
+            help="Fiscal years of travel, ending with the current one (3)",
+        )
+        parser.add_argument(
+            "--treqs", type=int, default=5000, help="Number of travel requests (5000)"
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Random seed; the same seed builds the same data (0)",
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        counts = generate(
+            units=options["units"],
+            levels=options["levels"],
+            employees=options["employees"],
+            funds=options["funds"],
+            years=options["years"],
+            treqs=options["treqs"],
+            seed=options["seed"],
+        )
+        elapsed = time.perf_counter() - started
+        for name, count in counts.items():
+            self.stdout.write(f"{name}: {count}")
+        self.stdout.write(f"Generated in {elapsed:.1f}s")
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from terra.models import EmployeeSummary
+from terra.summary import rebuild_summary
+
+
+class Command(BaseCommand):
+    help = "Rebuild the employee report summary table from the travel data"
+
+    def handle(self, *args, **options):
+        rebuild_summary()
+        count = EmployeeSummary.objects.count()
+        self.stdout.write(f"Rebuilt report summary: {count} rows")
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from terra.models import TravelRequest, stored_totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Check the stored funding, expense and vacation totals on travel "
+        "requests against their rows, and optionally repair them"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--repair", action="store_true", help="Recompute the totals that differ"
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drifted = list(
+                TravelRequest.objects.drifted().select_for_update().order_by("id")
+            )
+            for treq in drifted:
+                for name in stored_totals():
+                    stored = getattr(treq, name)
+                    computed = getattr(treq, f"computed_{name}")
+                    if stored != computed:
+                        self.stdout.write(
+                            f"Travel request {treq.id}: {name} is {stored}, "
+                            f"should be {computed}"
+                        )
+            if options["repair"] and drifted:
+                TravelRequest.objects.filter(
+                    pk__in=[treq.pk for treq in drifted]
+                ).refresh_totals()
+        checked = TravelRequest.objects.count()
+        if not drifted:
+            self.stdout.write(f"All {checked} travel request totals are correct.")
+        elif options["repair"]:
+            self.stdout.write(f"Repaired {len(drifted)} of {checked} travel requests.")
+        else:
+            self.stdout.write(
+                f"{len(drifted)} of {checked} travel requests have wrong totals; "
+                "run with --repair to fix them."
+            )
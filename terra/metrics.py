@@ -0,0 +1,51 @@
+import os
+
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.multiprocess import MultiProcessCollector
+
+# Under gunicorn, each worker writes its samples to files in
+# PROMETHEUS_MULTIPROC_DIR and the endpoint adds them up across workers;
+# see docker_scripts/entrypoint.sh and docker_scripts/gunicorn.conf.py.
+# Without it the endpoint reports the serving process alone.
+REQUEST_SECONDS = Histogram(
+    "terra_request_duration_seconds",
+    "Time spent handling requests, by view.",
+    ["view"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+SQL_QUERIES = Counter(
+    "terra_sql_queries", "SQL queries run while handling requests.", ["view"]
+)
+SQL_SECONDS = Counter(
+    "terra_sql_duration_seconds",
+    "Time spent in SQL queries while handling requests.",
+    ["view"],
+)
+EXPORT_BYTES = Counter(
+    "terra_export_bytes", "Bytes of CSV exports sent, by view.", ["view"]
+)
+REPORT_CACHE_LOOKUPS = Counter(
+    "terra_report_cache_lookups", "Report cache lookups, by result.", ["result"]
+)
+
+
+def registry():
+    """
+    Returns the registry to serve: the samples of every worker in
+    multiprocess mode, otherwise those of this process.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    workers = CollectorRegistry()
+    MultiProcessCollector(workers)
+    return workers
+
+
+def exposition():
+    return generate_latest(registry())
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import logging
+import random
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from . import metrics
+
+logger = logging.getLogger("terra.profiling")
+
+# Duplicate queries listed per logged request.
+MAX_DUPLICATES = 5
+
+
+class QueryProfile:
+    """
+    Database execute wrapper that counts a request's queries, adds up their
+    time and counts each distinct statement. Django passes parameters
+    separately, so the SQL text is already a fingerprint of the query.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def duplicates(self):
+        """
+        Returns the statements run more than once, most repeated first.
+        """
+        return [
+            {
+                "fingerprint": hashlib.md5(sql.encode()).hexdigest()[:12],
+                "count": count,
+                "sql": sql[:200],
+            }
+            for sql, count in self.statements.most_common(MAX_DUPLICATES)
+            if count > 1
+        ]
+
+
+class QueryProfilingMiddleware:
+    """
+    Logs the queries, database time and repeated statements of requests
+    slower than QUERY_PROFILING_SLOW_MS, and of a QUERY_PROFILING_SAMPLE_RATE
+    fraction of the rest. Does nothing unless QUERY_PROFILING is set.
+    """
+
+    def __init__(self, get_response):
+        if not settings.QUERY_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_ms = settings.QUERY_PROFILING_SLOW_MS
+        self.sample_rate = settings.QUERY_PROFILING_SAMPLE_RATE
+
+    def __call__(self, request):
+        profile = QueryProfile()
+        started = time.perf_counter()
+        with connection.execute_wrapper(profile):
+            response = self.get_response(request)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        slow = elapsed_ms >= self.slow_ms
+        if slow or random.random() < self.sample_rate:
+            match = request.resolver_match
+            record = {
+                "view": match.view_name if match else None,
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "ms": round(elapsed_ms, 1),
+                "queries": profile.queries,
+                "db_ms": round(profile.seconds * 1000, 1),
+                "slow": slow,
+                "duplicates": profile.duplicates(),
+            }
+            logger.log(
+                logging.WARNING if slow else logging.INFO,
+                json.dumps(record, default=str),
+            )
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Records each request's latency, SQL queries and SQL time, and the size
+    of CSV exports, labelled by view name, for the metrics endpoint. Does
+    nothing unless METRICS is set.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = QueryProfile()
+        started = time.perf_counter()
+        with connection.execute_wrapper(profile):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+        # Label by URL pattern name, never by path, to bound the label values.
+        match = request.resolver_match
+        view = match.view_name if match else "unmatched"
+        metrics.REQUEST_SECONDS.labels(view).observe(elapsed)
+        metrics.SQL_QUERIES.labels(view).inc(profile.queries)
+        metrics.SQL_SECONDS.labels(view).inc(profile.seconds)
+        csv = response.get("Content-Type", "").startswith("text/csv")
+        if csv and not response.streaming:
+            metrics.EXPORT_BYTES.labels(view).inc(len(response.content))
+        return response
@@ -0,0 +1,75 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_unit_closure(apps, schema_editor):
+    Unit = apps.get_model("terra", "Unit")
+    UnitClosure = apps.get_model("terra", "UnitClosure")
+    parents = dict(Unit.objects.values_list("id", "parent_unit_id"))
+    links = []
+    for unit_id in parents:
+        ancestor_id, depth = unit_id, 0
+        while ancestor_id is not None:
+            links.append(
+                UnitClosure(ancestor_id=ancestor_id, descendant_id=unit_id, depth=depth)
+            )
+            ancestor_id, depth = parents[ancestor_id], depth + 1
+    UnitClosure.objects.bulk_create(links)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("terra", "0015_travelrequest_canceled"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UnitClosure",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("depth", models.PositiveIntegerField()),
+                (
+                    "ancestor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="descendant_links",
+                        to="terra.unit",
+                    ),
+                ),
+                (
+                    "descendant",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ancestor_links",
+                        to="terra.unit",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["descendant", "depth"],
+                        name="terra_unitc_descend_021263_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="unitclosure",
+            constraint=models.UniqueConstraint(
+                fields=("ancestor", "descendant"), name="unique_unit_closure"
+            ),
+        ),
+        migrations.RunPython(build_unit_closure, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_employee_closure(apps, schema_editor):
+    Employee = apps.get_model("terra", "Employee")
+    EmployeeClosure = apps.get_model("terra", "EmployeeClosure")
+    supervisors = dict(Employee.objects.values_list("id", "supervisor_id"))
+    links = []
+    for employee_id in supervisors:
+        ancestor_id, depth = employee_id, 0
+        while ancestor_id is not None:
+            links.append(
+                EmployeeClosure(
+                    ancestor_id=ancestor_id, descendant_id=employee_id, depth=depth
+                )
+            )
+            ancestor_id, depth = supervisors[ancestor_id], depth + 1
+    EmployeeClosure.objects.bulk_create(links, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("terra", "0016_unitclosure"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EmployeeClosure",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("depth", models.PositiveIntegerField()),
+                (
+                    "ancestor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="descendant_links",
+                        to="terra.employee",
+                    ),
+                ),
+                (
+                    "descendant",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ancestor_links",
+                        to="terra.employee",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["descendant", "depth"],
+                        name="terra_emplo_descend_f25dd0_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="employeeclosure",
+            constraint=models.UniqueConstraint(
+                fields=("ancestor", "descendant"), name="unique_employee_closure"
+            ),
+        ),
+        migrations.RunPython(build_employee_closure, migrations.RunPython.noop),
+    ]
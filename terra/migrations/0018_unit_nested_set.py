@@ -0,0 +1,49 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:42
+
+from collections import defaultdict
+from django.db import migrations, models
+
+
+def number_units(apps, schema_editor):
+    Unit = apps.get_model("terra", "Unit")
+    units = list(Unit.objects.order_by("name"))
+    children = defaultdict(list)
+    for unit in units:
+        children[unit.parent_unit_id].append(unit)
+    counter = 0
+    stack = [(unit, False) for unit in reversed(children[None])]
+    while stack:
+        unit, visited = stack.pop()
+        counter += 1
+        if visited:
+            unit.rgt = counter
+        else:
+            unit.lft = counter
+            stack.append((unit, True))
+            stack.extend((child, False) for child in reversed(children[unit.id]))
+    Unit.objects.bulk_update(units, ["lft", "rgt"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("terra", "0017_employeeclosure"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="unit",
+            name="lft",
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="unit",
+            name="rgt",
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="unit",
+            index=models.Index(fields=["lft", "rgt"], name="terra_unit_lft_468bf5_idx"),
+        ),
+        migrations.RunPython(number_units, migrations.RunPython.noop),
+    ]
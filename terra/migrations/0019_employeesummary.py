@@ -0,0 +1,117 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+from collections import defaultdict
+
+
+def fiscal_year(d):
+    # Fiscal years start on July 1 and are named for the year they end in.
+    return d.year + 1 if d.month >= 7 else d.year
+
+
+def build_summary(apps, schema_editor):
+    TravelRequest = apps.get_model("terra", "TravelRequest")
+    Funding = apps.get_model("terra", "Funding")
+    ActualExpense = apps.get_model("terra", "ActualExpense")
+    Vacation = apps.get_model("terra", "Vacation")
+    EmployeeSummary = apps.get_model("terra", "EmployeeSummary")
+
+    keys = {}
+    totals = defaultdict(lambda: defaultdict(int))
+    for treq in TravelRequest.objects.all():
+        keys[treq.pk] = (
+            treq.traveler_id,
+            fiscal_year(treq.departure_date),
+            fiscal_year(treq.return_date),
+            treq.administrative,
+        )
+        if not treq.canceled:
+            totals[keys[treq.pk]]["days_away"] += treq.days_ooo
+    for treq_id, amount in Funding.objects.values_list("treq", "amount"):
+        totals[keys[treq_id]]["requested"] += amount
+    for treq_id, duration in Vacation.objects.values_list("treq", "duration"):
+        totals[keys[treq_id]]["days_vacation"] += duration
+    for treq_id, total, date_paid in ActualExpense.objects.values_list(
+        "treq", "total", "date_paid"
+    ):
+        employee_id, start, end, administrative = keys[treq_id]
+        year = fiscal_year(date_paid)
+        totals[(employee_id, year, year, administrative)]["spent"] += total
+    EmployeeSummary.objects.bulk_create(
+        [
+            EmployeeSummary(
+                employee_id=employee_id,
+                start_year=start_year,
+                end_year=end_year,
+                administrative=administrative,
+                **fields,
+            )
+            for (
+                employee_id,
+                start_year,
+                end_year,
+                administrative,
+            ), fields in totals.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("terra", "0018_unit_nested_set"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EmployeeSummary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("start_year", models.PositiveSmallIntegerField()),
+                ("end_year", models.PositiveSmallIntegerField()),
+                ("administrative", models.BooleanField()),
+                (
+                    "requested",
+                    models.DecimalField(decimal_places=5, default=0, max_digits=15),
+                ),
+                (
+                    "spent",
+                    models.DecimalField(decimal_places=5, default=0, max_digits=15),
+                ),
+                ("days_away", models.IntegerField(default=0)),
+                ("days_vacation", models.IntegerField(default=0)),
+                (
+                    "employee",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="terra.employee"
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["start_year", "end_year"],
+                        name="terra_emplo_start_y_30213a_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="employeesummary",
+            constraint=models.UniqueConstraint(
+                fields=("employee", "start_year", "end_year", "administrative"),
+                name="unique_employee_summary",
+            ),
+        ),
+        migrations.RunPython(build_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+def fiscal_year(d):
+    # Fiscal years start on July 1 and are named for the year they end in.
+    return d.year + 1 if d.month >= 7 else d.year
+
+
+def set_fiscal_years(apps, schema_editor):
+    TravelRequest = apps.get_model("terra", "TravelRequest")
+    ActualExpense = apps.get_model("terra", "ActualExpense")
+
+    treqs = list(TravelRequest.objects.only("departure_date", "return_date"))
+    for treq in treqs:
+        treq.departure_fiscal_year = fiscal_year(treq.departure_date)
+        treq.fiscal_year = fiscal_year(treq.return_date)
+    TravelRequest.objects.bulk_update(
+        treqs, ["departure_fiscal_year", "fiscal_year"], batch_size=1000
+    )
+    expenses = list(ActualExpense.objects.only("date_paid"))
+    for expense in expenses:
+        expense.fiscal_year = fiscal_year(expense.date_paid)
+    ActualExpense.objects.bulk_update(expenses, ["fiscal_year"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("terra", "0019_employeesummary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="travelrequest",
+            name="departure_fiscal_year",
+            field=models.PositiveSmallIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="travelrequest",
+            name="fiscal_year",
+            field=models.PositiveSmallIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="actualexpense",
+            name="fiscal_year",
+            field=models.PositiveSmallIntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(set_fiscal_years, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="travelrequest",
+            name="departure_fiscal_year",
+            field=models.PositiveSmallIntegerField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name="travelrequest",
+            name="fiscal_year",
+            field=models.PositiveSmallIntegerField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name="actualexpense",
+            name="fiscal_year",
+            field=models.PositiveSmallIntegerField(db_index=True, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="travelrequest",
+            index=models.Index(
+                fields=["departure_fiscal_year", "fiscal_year"],
+                name="terra_trave_departu_33ea7f_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("terra", "0020_fiscal_year_columns"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="travelrequest",
+            name="terra_trave_departu_33ea7f_idx",
+        ),
+        migrations.AddIndex(
+            model_name="actualexpense",
+            index=models.Index(
+                fields=["treq", "fiscal_year"], name="terra_actua_treq_id_9caef7_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="actualexpense",
+            index=models.Index(
+                fields=["fund", "fiscal_year", "treq"],
+                name="terra_actua_fund_id_d065fd_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="funding",
+            index=models.Index(
+                fields=["fund", "treq"], name="terra_fundi_fund_id_6a299d_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="travelrequest",
+            index=models.Index(
+                fields=["traveler", "departure_fiscal_year", "fiscal_year"],
+                name="terra_trave_travele_a6bda9_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="travelrequest",
+            index=models.Index(
+                condition=models.Q(("canceled", False)),
+                fields=["traveler", "departure_fiscal_year", "fiscal_year"],
+                name="terra_treq_active_fy_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+def set_display_names(apps, schema_editor):
+    Employee = apps.get_model("terra", "Employee")
+
+    employees = list(Employee.objects.select_related("user"))
+    for employee in employees:
+        employee.display_name = f"{employee.user.last_name}, {employee.user.first_name}"
+    Employee.objects.bulk_update(employees, ["display_name"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("terra", "0021_report_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="employee",
+            name="display_name",
+            field=models.CharField(default="", editable=False, max_length=302),
+            preserve_default=False,
+        ),
+        migrations.RunPython(set_display_names, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="employee",
+            name="display_name",
+            field=models.CharField(db_index=True, editable=False, max_length=302),
+        ),
+        migrations.AlterModelOptions(
+            name="employee",
+            options={"ordering": ["display_name", "id"]},
+        ),
+    ]
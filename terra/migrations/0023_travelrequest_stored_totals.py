@@ -0,0 +1,58 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:40
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def set_totals(apps, schema_editor):
+    TravelRequest = apps.get_model("terra", "TravelRequest")
+
+    def child_total(model_name, field, zero):
+        rows = (
+            apps.get_model("terra", model_name)
+            .objects.filter(treq=OuterRef("pk"))
+            .order_by()
+            .values("treq")
+            .annotate(total=Sum(field))
+            .values("total")
+        )
+        return Coalesce(Subquery(rows), zero)
+
+    TravelRequest.objects.update(
+        funding_total=child_total("Funding", "amount", Decimal(0)),
+        expense_total=child_total("ActualExpense", "total", Decimal(0)),
+        vacation_days_total=child_total("Vacation", "duration", 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("terra", "0022_employee_display_name"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="travelrequest",
+            name="expense_total",
+            field=models.DecimalField(
+                decimal_places=5, default=0, editable=False, max_digits=15
+            ),
+        ),
+        migrations.AddField(
+            model_name="travelrequest",
+            name="funding_total",
+            field=models.DecimalField(
+                decimal_places=5, default=0, editable=False, max_digits=15
+            ),
+        ),
+        migrations.AddField(
+            model_name="travelrequest",
+            name="vacation_days_total",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(set_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:21
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("terra", "0023_travelrequest_stored_totals"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="travelrequest",
+            name="terra_treq_active_fy_idx",
+        ),
+    ]
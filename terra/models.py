@@ -1,6 +1,9 @@
-from django.db import models
+from collections import defaultdict
+from decimal import Decimal
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.db.models import Sum, F
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 
 from terra import utils
 
@@ -44,9 +47,14 @@ class Unit(models.Model):
     parent_unit = models.ForeignKey(
         "self", on_delete=models.PROTECT, related_name="subunits", null=True, blank=True
     )
+    # Nested-set numbering: a unit's subtree is every unit whose lft falls
+    # between its lft and rgt. Maintained by Unit.number_tree().
+    lft = models.PositiveIntegerField(null=True, editable=False)
+    rgt = models.PositiveIntegerField(null=True, editable=False)
 
     class Meta:
         ordering = ["name"]
+        indexes = [models.Index(fields=["lft", "rgt"])]
 
     def __str__(self):
         return self.name
@@ -57,19 +65,79 @@ class Unit(models.Model):
     def employee_count(self):
         return self.employee_set.count()
 
-    def super_managers(self, mgrs=None):
-        if mgrs is None:
-            mgrs = []
-        mgrs.append(self.manager)
-        if self.parent_unit is None:
-            return mgrs
-        return self.parent_unit.super_managers(mgrs)
+    def super_managers(self):
+        links = self.ancestor_links.select_related("ancestor__manager__user")
+        return [link.ancestor.manager for link in links.order_by("depth")]
 
     def all_employees(self):
-        team = list(self.employee_set.all())
-        for subunit in self.subunits.all():
-            team.extend(subunit.all_employees())
-        return team
+        return list(Employee.objects.filter(unit__ancestor_links__ancestor=self))
+
+    def subtree(self):
+        return Unit.objects.filter(lft__gte=self.lft, lft__lte=self.rgt)
+
+    @classmethod
+    def number_tree(cls):
+        units = list(cls.objects.all())
+        children = defaultdict(list)
+        for unit in units:
+            children[unit.parent_unit_id].append(unit)
+        counter = 0
+        stack = [(unit, False) for unit in reversed(children[None])]
+        while stack:
+            unit, visited = stack.pop()
+            counter += 1
+            if visited:
+                unit.rgt = counter
+            else:
+                unit.lft = counter
+                stack.append((unit, True))
+                stack.extend((child, False) for child in reversed(children[unit.id]))
+        cls.objects.bulk_update(units, ["lft", "rgt"])
+
+
+class UnitClosure(models.Model):
+    """
+    Every (ancestor, descendant) pair in the unit tree, including each
+    unit paired with itself at depth 0. Kept in sync by terra.signals.
+    """
+
+    ancestor = models.ForeignKey(
+        "Unit", on_delete=models.CASCADE, related_name="descendant_links"
+    )
+    descendant = models.ForeignKey(
+        "Unit", on_delete=models.CASCADE, related_name="ancestor_links"
+    )
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["ancestor", "descendant"], name="unique_unit_closure"
+            )
+        ]
+        indexes = [models.Index(fields=["descendant", "depth"])]
+
+    def __repr__(self):
+        return "<UnitClosure {} > {}: {}>".format(
+            self.ancestor_id, self.descendant_id, self.depth
+        )
+
+    @classmethod
+    def rebuild(cls):
+        parents = dict(Unit.objects.values_list("id", "parent_unit_id"))
+        links = []
+        for unit_id in parents:
+            ancestor_id, depth = unit_id, 0
+            # Units whose parent has not been saved yet (e.g. out-of-order
+            # fixtures) are linked when the parent's save rebuilds again.
+            while ancestor_id in parents:
+                links.append(
+                    cls(ancestor_id=ancestor_id, descendant_id=unit_id, depth=depth)
+                )
+                ancestor_id, depth = parents[ancestor_id], depth + 1
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(links)
 
 
 class Employee(models.Model):
@@ -86,12 +154,19 @@ class Employee(models.Model):
         max_digits=10, decimal_places=5, null=True, blank=True
     )
     allocation_expire_date = models.DateField(null=True, blank=True)
+    # "Last, First" from the user, kept in sync by terra.signals so that
+    # employees can be named and sorted without joining auth_user.
+    display_name = models.CharField(max_length=302, editable=False, db_index=True)
 
     class Meta:
-        ordering = [F("user__last_name"), F("user__first_name")]
+        ordering = ["display_name", "id"]
 
     def __str__(self):
-        return f"{self.user.last_name}, {self.user.first_name}"
+        return self.display_name
+
+    @staticmethod
+    def display_name_for(user):
+        return f"{user.last_name}, {user.first_name}"
 
     def __repr__(self):
         return "<Employee {}: {}>".format(self.id, self)
@@ -118,16 +193,31 @@ class Employee(models.Model):
     def direct_reports(self):
         return Employee.objects.filter(supervisor=self)
 
+    def all_reports(self):
+        # Everyone below this employee in the supervisor tree, at any depth.
+        return Employee.objects.filter(
+            ancestor_links__ancestor=self, ancestor_links__depth__gt=0
+        )
+
+    def supervisor_chain(self):
+        # This employee followed by each supervisor above them, in order.
+        links = self.ancestor_links.select_related("ancestor__user")
+        return [link.ancestor for link in links.order_by("depth")]
+
     def full_team(self):
-        staff = [self]
+        reports = defaultdict(list)
+        for e in self.all_reports().select_related("user"):
+            reports[e.supervisor_id].append(e)
+        # Walk the tree depth first, as the recursive version used to.
+        staff = []
         managers = []
-        direct_reports = self.direct_reports()
-        if len(direct_reports) > 0:
-            managers.append(self)
-            for e in direct_reports:
-                substaff, submgrs = e.full_team()
-                staff.extend(substaff)
-                managers.extend(submgrs)
+        stack = [self]
+        while stack:
+            e = stack.pop()
+            staff.append(e)
+            if reports[e.id]:
+                managers.append(e)
+                stack.extend(reversed(reports[e.id]))
         return staff, managers
 
     def treqs_in_fiscal_year(self, fiscal_year=None):
@@ -145,6 +235,83 @@ class Employee(models.Model):
         return self.employee_set.order_by("unit")
 
 
+class EmployeeClosure(models.Model):
+    """
+    Every (supervisor, report) pair in the supervisor tree at any depth,
+    including each employee paired with themselves at depth 0. Kept in
+    sync by terra.signals.
+    """
+
+    ancestor = models.ForeignKey(
+        "Employee", on_delete=models.CASCADE, related_name="descendant_links"
+    )
+    descendant = models.ForeignKey(
+        "Employee", on_delete=models.CASCADE, related_name="ancestor_links"
+    )
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["ancestor", "descendant"], name="unique_employee_closure"
+            )
+        ]
+        indexes = [models.Index(fields=["descendant", "depth"])]
+
+    def __repr__(self):
+        return "<EmployeeClosure {} > {}: {}>".format(
+            self.ancestor_id, self.descendant_id, self.depth
+        )
+
+    @classmethod
+    def rebuild(cls):
+        supervisors = dict(Employee.objects.values_list("id", "supervisor_id"))
+        links = []
+        for employee_id in supervisors:
+            ancestor_id, depth = employee_id, 0
+            while ancestor_id in supervisors:
+                links.append(
+                    cls(ancestor_id=ancestor_id, descendant_id=employee_id, depth=depth)
+                )
+                ancestor_id, depth = supervisors[ancestor_id], depth + 1
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(links, batch_size=1000)
+
+    @classmethod
+    def attach(cls, employee):
+        """
+        Links employee, and everyone already below them, under their
+        current supervisor's chain.
+        """
+        subtree = list(
+            cls.objects.filter(ancestor=employee).values_list("descendant_id", "depth")
+        )
+        with transaction.atomic():
+            if not subtree:
+                subtree = [(employee.id, 0)]
+                cls.objects.create(ancestor=employee, descendant=employee, depth=0)
+            subtree_ids = [descendant_id for descendant_id, depth in subtree]
+            cls.objects.filter(descendant_id__in=subtree_ids).exclude(
+                ancestor_id__in=subtree_ids
+            ).delete()
+            above = cls.objects.filter(descendant_id=employee.supervisor_id)
+            cls.objects.bulk_create(
+                [
+                    cls(
+                        ancestor_id=ancestor_id,
+                        descendant_id=descendant_id,
+                        depth=ancestor_depth + depth + 1,
+                    )
+                    for ancestor_id, ancestor_depth in above.values_list(
+                        "ancestor_id", "depth"
+                    )
+                    for descendant_id, depth in subtree
+                ],
+                batch_size=1000,
+            )
+
+
 class Fund(models.Model):
     account = models.CharField(max_length=6)
     cost_center = models.CharField(max_length=2)
@@ -162,10 +329,54 @@ class Fund(models.Model):
         return "<Fund {}: {}>".format(self.id, self)
 
     def super_managers(self):
-        mgrs = [self.manager]
-        while mgrs[-1].supervisor is not None:
-            mgrs.append(mgrs[-1].supervisor)
-        return mgrs
+        return self.manager.supervisor_chain()
+
+
+def child_total(model, field, zero):
+    """
+    Returns a subquery summing field over the model's rows for the outer
+    travel request, or zero when there are none.
+    """
+    total = (
+        model.objects.filter(treq=OuterRef("pk"))
+        .order_by()
+        .values("treq")
+        .annotate(total=Sum(field))
+        .values("total")
+    )
+    return Coalesce(Subquery(total), zero)
+
+
+def stored_totals():
+    """
+    Returns the expressions that recompute each stored travel request total
+    from its funding, expense and vacation rows.
+    """
+    return {
+        "funding_total": child_total(Funding, "amount", Decimal(0)),
+        "expense_total": child_total(ActualExpense, "total", Decimal(0)),
+        "vacation_days_total": child_total(Vacation, "duration", 0),
+    }
+
+
+class TravelRequestQuerySet(models.QuerySet):
+    def drifted(self):
+        """
+        Returns the requests whose stored totals disagree with their rows,
+        annotated with the recomputed totals as computed_<field>.
+        """
+        return self.annotate(
+            **{f"computed_{name}": total for name, total in stored_totals().items()}
+        ).exclude(
+            **{name: F(f"computed_{name}") for name in stored_totals()},
+        )
+
+    def refresh_totals(self):
+        """
+        Recomputes the stored totals from the rows, for writes that skip
+        the signals. Returns the number of requests updated.
+        """
+        return self.update(**stored_totals())
 
 
 class TravelRequest(models.Model):
@@ -173,6 +384,10 @@ class TravelRequest(models.Model):
     activity = models.ForeignKey("Activity", on_delete=models.PROTECT)
     departure_date = models.DateField()
     return_date = models.DateField()
+    # Fiscal years of departure_date and return_date, kept in sync by
+    # terra.signals so that reports can filter on whole fiscal years.
+    departure_fiscal_year = models.PositiveSmallIntegerField(editable=False)
+    fiscal_year = models.PositiveSmallIntegerField(editable=False)
     days_ooo = models.IntegerField("Days Out of Office")
     closed = models.BooleanField(default=False)
     administrative = models.BooleanField(default=False)
@@ -189,6 +404,23 @@ class TravelRequest(models.Model):
     international_approved_on = models.DateField(null=True, blank=True)
     note = models.TextField(blank=True)
     canceled = models.BooleanField(default=False)
+    # Sums of the request's funding, expense and vacation rows, kept up to
+    # date by terra.signals; "manage.py verify_treq_totals" checks them.
+    funding_total = models.DecimalField(
+        max_digits=15, decimal_places=5, default=0, editable=False
+    )
+    expense_total = models.DecimalField(
+        max_digits=15, decimal_places=5, default=0, editable=False
+    )
+    vacation_days_total = models.IntegerField(default=0, editable=False)
+
+    objects = TravelRequestQuerySet.as_manager()
+
+    class Meta:
+        # Reports select a set of travelers' requests by fiscal year.
+        indexes = [
+            models.Index(fields=["traveler", "departure_fiscal_year", "fiscal_year"]),
+        ]
 
     def __str__(self):
         return str(repr(self))
@@ -201,6 +433,22 @@ class TravelRequest(models.Model):
             self.departure_date.strftime("%Y"),
         )
 
+    def save(self, *args, **kwargs):
+        # Only terra.signals writes the stored totals, as F() updates, so a
+        # save never writes back a possibly stale copy of them. A new request
+        # has no rows yet, even when copied from another.
+        totals = stored_totals()
+        if self.pk is None or self._state.adding:
+            for name in totals:
+                setattr(self, name, 0)
+        elif kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in totals
+            ]
+        super().save(*args, **kwargs)
+
     def international(self):
         return self.activity.country != "USA"
 
@@ -217,27 +465,24 @@ class TravelRequest(models.Model):
     funded.boolean = True
 
     def actual_expenses(self):
-        return sum([ae.total for ae in self.actualexpense_set.all()])
+        return self.expense_total
 
     def expenditures_total(self):
         return utils.format_currency(self.actual_expenses())
 
     def approved_funds(self):
-        return sum([a.amount for a in self.funding_set.all()])
+        return self.funding_total
 
     def in_fiscal_year(self, fiscal_year=None):
         return utils.in_fiscal_year(self.return_date, fiscal_year)
 
     def total_funding(self):
-        total = self.funding_set.aggregate(Sum("amount"))["amount__sum"]
-        if total is None:
-            total = 0
-        return total
+        return self.funding_total
 
     in_fiscal_year.boolean = True
 
     def vacation_days(self):
-        return sum([v.vacation_days() for v in self.vacation_set.all()])
+        return self.vacation_days_total
 
     def total_days_out(self):
         total_days = self.vacation_days() + self.days_ooo
@@ -247,7 +492,23 @@ class TravelRequest(models.Model):
         return utils.format_currency(self.total_funding())
 
 
-class Vacation(models.Model):
+class StoredTotalRow(models.Model):
+    """
+    A funding, expense or vacation row, which terra.signals adds into its
+    travel request's stored totals.
+    """
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        # The signals lock the row and update the totals inside this
+        # transaction, so the row and the totals commit together.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class Vacation(StoredTotalRow):
     treq = models.ForeignKey("TravelRequest", on_delete=models.CASCADE)
     start = models.DateField()
     end = models.DateField()
@@ -268,6 +529,43 @@ class Vacation(models.Model):
         super().save(*args, **kwargs)
 
 
+class EmployeeSummary(models.Model):
+    """
+    Running report totals for an employee, maintained by terra.summary.
+    Travel request amounts are keyed by the fiscal years of departure and
+    return, expenses by the fiscal year paid (start_year == end_year), so
+    a report on fiscal years s..e sums the rows with start_year >= s and
+    end_year <= e.
+    """
+
+    employee = models.ForeignKey("Employee", on_delete=models.CASCADE)
+    start_year = models.PositiveSmallIntegerField()
+    end_year = models.PositiveSmallIntegerField()
+    administrative = models.BooleanField()
+    requested = models.DecimalField(max_digits=15, decimal_places=5, default=0)
+    spent = models.DecimalField(max_digits=15, decimal_places=5, default=0)
+    days_away = models.IntegerField(default=0)
+    days_vacation = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["employee", "start_year", "end_year", "administrative"],
+                name="unique_employee_summary",
+            )
+        ]
+        indexes = [models.Index(fields=["start_year", "end_year"])]
+
+    def __repr__(self):
+        return "<EmployeeSummary {}: {} FY{}-FY{}{}>".format(
+            self.id,
+            self.employee_id,
+            self.start_year,
+            self.end_year,
+            " admin" if self.administrative else "",
+        )
+
+
 class Activity(models.Model):
     name = models.CharField(max_length=128)
     url = models.URLField(blank=True)
@@ -292,7 +590,7 @@ class Activity(models.Model):
         return self.country == "USA"
 
 
-class Funding(models.Model):
+class Funding(StoredTotalRow):
     funded_on = models.DateTimeField(auto_now_add=True)
     funded_by = models.ForeignKey("Employee", on_delete=models.PROTECT)
     treq = models.ForeignKey("TravelRequest", on_delete=models.PROTECT)
@@ -302,6 +600,7 @@ class Funding(models.Model):
 
     class Meta:
         verbose_name_plural = "Funding"
+        indexes = [models.Index(fields=["fund", "treq"])]
 
     def __str__(self):
         return str(repr(self))
@@ -312,7 +611,7 @@ class Funding(models.Model):
         )
 
 
-class ActualExpense(models.Model):
+class ActualExpense(StoredTotalRow):
     treq = models.ForeignKey("TravelRequest", on_delete=models.CASCADE)
     type = models.CharField(max_length=3, choices=EXPENSE_TYPES)
     rate = models.DecimalField(max_digits=10, decimal_places=5, null=True, blank=True)
@@ -320,8 +619,16 @@ class ActualExpense(models.Model):
     total = models.DecimalField(max_digits=10, decimal_places=5)
     fund = models.ForeignKey("Fund", on_delete=models.PROTECT)
     date_paid = models.DateField()
+    # Fiscal year of date_paid, kept in sync by terra.signals.
+    fiscal_year = models.PositiveSmallIntegerField(editable=False, db_index=True)
     reimbursed = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["treq", "fiscal_year"]),
+            models.Index(fields=["fund", "fiscal_year", "treq"]),
+        ]
+
     def __str__(self):
         return str(repr(self))
 
@@ -1,5 +1,7 @@
+from bisect import bisect_right
+from datetime import date
 from decimal import Decimal
-from django.core.exceptions import ObjectDoesNotExist
+from django.conf import settings
 from django.db.models import (
     F,
     Q,
@@ -13,8 +15,26 @@ from django.db.models import (
 from django.db.models.functions import Coalesce
 
 
-from .models import TravelRequest, Employee, Funding, ActualExpense
-from .utils import fiscal_year_bookends, profdev_spending_cap, profdev_days_cap
+from .models import (
+    TravelRequest,
+    Employee,
+    Funding,
+    ActualExpense,
+    Vacation,
+    UnitClosure,
+    EmployeeSummary,
+)
+from .utils import (
+    current_fiscal_year,
+    fiscal_year_bookends,
+    profdev_spending_cap,
+    profdev_days_cap,
+)
+from .timing import span, timed
+
+# Each stage is timed into the per-process histograms shown on the
+# diagnostics page. Stages that return unevaluated querysets are timed
+# again where the caller reads them.
 
 
 def check_dates(start_date, end_date):
@@ -27,166 +47,289 @@ def check_dates(start_date, end_date):
     return start_date, end_date
 
 
+@timed
 def get_subunits_and_employees(unit):
-    data = {
-        "subunits": {
-            unit.id: {
-                "subunit": unit,
-                "employees": {e.id: e for e in unit.employee_set.all()},
-            }
-        }
-    }
+    data = {"subunits": {unit.id: {"subunit": unit, "employees": {}}}}
     for subunit in unit.subunits.all():
-        data["subunits"][subunit.id] = {
-            "subunit": subunit,
-            "employees": {e.id: e for e in subunit.all_employees()},
-        }
-    return data
-
-
-def get_individual_data(employee_ids, start_date=None, end_date=None):
-    start_date, end_date = check_dates(start_date, end_date)
-    # 4 subqueries plugged into the final query
+        data["subunits"][subunit.id] = {"subunit": subunit, "employees": {}}
 
-    profdev_requested = (
-        TravelRequest.objects.filter(
-            traveler=OuterRef("pk"),
-            administrative=False,
-            departure_date__gte=start_date,
-            return_date__lte=end_date,
+    # Map every unit in the tree to the direct subunit it rolls up into;
+    # the unit's own employees stay with the unit itself.
+    rollup = dict(
+        UnitClosure.objects.filter(ancestor__parent_unit=unit).values_list(
+            "descendant_id", "ancestor_id"
         )
-        .values("traveler__pk")
-        .annotate(profdev_requested=Sum("funding__amount"))
-        .values("profdev_requested")
     )
+    rollup[unit.id] = unit.id
+    for e in Employee.objects.filter(unit_id__in=rollup):
+        data["subunits"][rollup[e.unit_id]]["employees"][e.id] = e
+    return data
 
-    profdev_spent = (
-        TravelRequest.objects.filter(traveler=OuterRef("pk"), administrative=False)
-        .values("traveler__pk")
-        .annotate(
-            profdev_spent=Sum(
-                "actualexpense__total",
-                filter=Q(actualexpense__date_paid__lte=end_date)
-                & Q(actualexpense__date_paid__gte=start_date),
-            )
-        )
-        .values("profdev_spent")
-    )
 
-    admin_requested = (
-        TravelRequest.objects.filter(
-            traveler=OuterRef("pk"),
-            administrative=True,
-            departure_date__gte=start_date,
-            return_date__lte=end_date,
-        )
-        .values("traveler__pk")
-        .annotate(admin_requested=Sum("funding__amount"))
-        .values("admin_requested")
-    )
+# Measures the report kernel can compute, grouped by the fact table ("ledger")
+# that supplies them. Each ledger is read in a single grouped query.
+LEDGER_MEASURES = {
+    "funding": {
+        "profdev_requested": Sum(
+            "amount", filter=Q(treq__administrative=False), default=Decimal(0)
+        ),
+        "admin_requested": Sum(
+            "amount", filter=Q(treq__administrative=True), default=Decimal(0)
+        ),
+    },
+    "actualexpense": {
+        "profdev_spent": Sum(
+            "total", filter=Q(treq__administrative=False), default=Decimal(0)
+        ),
+        "admin_spent": Sum(
+            "total", filter=Q(treq__administrative=True), default=Decimal(0)
+        ),
+    },
+    "travelrequest": {
+        "profdev_days_away": Sum("days_ooo", filter=Q(administrative=False), default=0),
+        "admin_days_away": Sum("days_ooo", filter=Q(administrative=True), default=0),
+    },
+    "vacation": {
+        "days_vacation": Sum("duration", default=0),
+    },
+}
+
+# Measures derived from other measures once the ledgers have been read.
+DERIVED_MEASURES = {
+    "total_requested": ("profdev_requested", "admin_requested"),
+    "total_spent": ("profdev_spent", "admin_spent"),
+    "total_days_ooo": ("profdev_days_away", "admin_days_away"),
+}
+
+INDIVIDUAL_MEASURES = (
+    "profdev_requested",
+    "profdev_spent",
+    "admin_requested",
+    "admin_spent",
+    "days_vacation",
+    "profdev_days_away",
+    "admin_days_away",
+)
 
-    admin_spent = (
-        TravelRequest.objects.filter(traveler=OuterRef("pk"), administrative=True)
-        .values("traveler__pk")
-        .annotate(
-            admin_spent=Sum(
-                "actualexpense__total",
-                filter=Q(actualexpense__date_paid__lte=end_date)
-                & Q(actualexpense__date_paid__gte=start_date),
-            )
-        )
-        .values("admin_spent")
-    )
+UNIT_TREE_MEASURES = (
+    "profdev_requested",
+    "profdev_spent",
+    "admin_requested",
+    "admin_spent",
+    "total_requested",
+    "total_spent",
+)
 
-    days_vacation = TravelRequest.objects.filter(
-        traveler=OuterRef("pk"),
-        departure_date__gte=start_date,
-        return_date__lte=end_date,
-    ).annotate(days_vacation=Sum("vacation__duration"))
+EMPLOYEE_MEASURES = (
+    "profdev_requested",
+    "profdev_spent",
+    "admin_requested",
+    "admin_spent",
+    "profdev_days_away",
+    "total_requested",
+    "total_spent",
+    "admin_days_away",
+)
 
-    profdev_days_away = (
-        TravelRequest.objects.filter(
-            traveler=OuterRef("pk"),
-            departure_date__gte=start_date,
-            return_date__lte=end_date,
-            administrative=False,
+
+def get_ledger(ledger, employee_ids, start_date, end_date, group_by="eid"):
+    """
+    Returns the rows of one ledger that fall in the reporting window, as a
+    queryset grouped by traveler (group_by="eid") or by the traveler's unit
+    (group_by="unit").
+    """
+    if ledger == "funding":
+        rows = Funding.objects.filter(
+            treq_in_window(start_date, end_date, "treq__"),
+            treq__traveler__in=employee_ids,
+        )
+        traveler = "treq__traveler"
+    elif ledger == "actualexpense":
+        rows = ActualExpense.objects.filter(
+            paid_in_window(start_date, end_date), treq__traveler__in=employee_ids
+        )
+        traveler = "treq__traveler"
+    elif ledger == "travelrequest":
+        rows = TravelRequest.objects.filter(
+            treq_in_window(start_date, end_date),
+            traveler__in=employee_ids,
             canceled=False,
         )
-        .values("traveler_id")
-        .annotate(profdev_days_away=Sum("days_ooo"))
-    )
-    admin_days_away = (
-        TravelRequest.objects.filter(
-            traveler=OuterRef("pk"),
-            departure_date__gte=start_date,
-            return_date__lte=end_date,
-            administrative=True,
-            canceled=False,
+        traveler = "traveler"
+    elif ledger == "vacation":
+        rows = Vacation.objects.filter(
+            treq_in_window(start_date, end_date, "treq__"),
+            treq__traveler__in=employee_ids,
+        )
+        traveler = "treq__traveler"
+    else:
+        raise ValueError(f"Unknown ledger: {ledger}")
+    if group_by == "unit":
+        traveler = f"{traveler}__unit"
+    return rows.order_by().values(**{group_by: F(traveler)})
+
+
+# The same measures, read from the EmployeeSummary table.
+SUMMARY_MEASURES = {
+    "profdev_requested": Sum(
+        "requested", filter=Q(administrative=False), default=Decimal(0)
+    ),
+    "admin_requested": Sum(
+        "requested", filter=Q(administrative=True), default=Decimal(0)
+    ),
+    "profdev_spent": Sum("spent", filter=Q(administrative=False), default=Decimal(0)),
+    "admin_spent": Sum("spent", filter=Q(administrative=True), default=Decimal(0)),
+    "profdev_days_away": Sum("days_away", filter=Q(administrative=False), default=0),
+    "admin_days_away": Sum("days_away", filter=Q(administrative=True), default=0),
+    "days_vacation": Sum("days_vacation", default=0),
+}
+
+
+def fiscal_year_window(start_date, end_date):
+    """
+    Returns (start year, end year) if the window is exactly a run of whole
+    fiscal years, otherwise None.
+    """
+    if not isinstance(start_date, date) or not isinstance(end_date, date):
+        return None
+    start_year = current_fiscal_year(today=start_date)
+    end_year = current_fiscal_year(today=end_date)
+    if (
+        fiscal_year_bookends(start_year)[0] != start_date
+        or fiscal_year_bookends(end_year)[1] != end_date
+    ):
+        return None
+    return start_year, end_year
+
+
+def treq_in_window(start_date, end_date, prefix=""):
+    """
+    Matches travel requests that depart and return inside the window.
+    Whole-fiscal-year windows compare the stored fiscal-year columns.
+    """
+    years = fiscal_year_window(start_date, end_date)
+    if years is None:
+        return Q(
+            **{
+                f"{prefix}departure_date__gte": start_date,
+                f"{prefix}return_date__lte": end_date,
+            }
         )
-        .values("traveler_id")
-        .annotate(admin_days_away=Sum("days_ooo"))
+    return Q(
+        **{
+            f"{prefix}departure_fiscal_year__gte": years[0],
+            f"{prefix}fiscal_year__lte": years[1],
+        }
     )
 
-    # final query
 
-    rows = (
-        Employee.objects.filter(pk__in=employee_ids)
-        .annotate(
-            profdev_requested=Coalesce(
-                Subquery(profdev_requested, output_field=DecimalField()), Decimal(0)
-            ),
-            profdev_spent=Coalesce(
-                Subquery(profdev_spent, output_field=DecimalField()), Decimal(0)
-            ),
-            admin_requested=Coalesce(
-                Subquery(admin_requested, output_field=DecimalField()), Decimal(0)
-            ),
-            admin_spent=Coalesce(
-                Subquery(admin_spent, output_field=DecimalField()), Decimal(0)
-            ),
-            days_vacation=Coalesce(
-                Subquery(
-                    days_vacation.values("days_vacation")[:1],
-                    output_field=IntegerField(),
-                ),
-                Value(0),
-            ),
-            profdev_days_away=Coalesce(
-                Subquery(
-                    profdev_days_away.values("profdev_days_away")[:1],
-                    output_field=IntegerField(),
-                ),
-                Value(0),
-            ),
-            admin_days_away=Coalesce(
-                Subquery(
-                    admin_days_away.values("admin_days_away")[:1],
-                    output_field=IntegerField(),
-                ),
-                Value(0),
-            ),
-        )
-        .values(
-            "id",
-            "profdev_requested",
-            "profdev_spent",
-            "admin_requested",
-            "admin_spent",
-            "days_vacation",
-            "profdev_days_away",
-            "admin_days_away",
-        )
-    )
+def paid_in_window(start_date, end_date, prefix=""):
+    """
+    Matches expenses paid inside the window, by stored fiscal year where
+    the window is whole fiscal years.
+    """
+    years = fiscal_year_window(start_date, end_date)
+    if years is None:
+        return Q(**{f"{prefix}date_paid__range": (start_date, end_date)})
+    return Q(**{f"{prefix}fiscal_year__range": years})
+
+
+@timed
+def read_summary(rows, employee_ids, start_year, end_year, needed, group_by="eid"):
+    """
+    Fills in rows like read_ledgers does, in a single query against the
+    EmployeeSummary table.
+    """
+    employee = {"eid": "employee", "unit": "employee__unit"}[group_by]
+    annotations = {m: SUMMARY_MEASURES[m] for m in needed}
+    for row in rows.values():
+        row.update({m: agg.default for m, agg in annotations.items()})
+    summary_rows = (
+        EmployeeSummary.objects.filter(
+            employee__in=employee_ids,
+            start_year__gte=start_year,
+            end_year__lte=end_year,
+        )
+        .order_by()
+        .values(**{group_by: F(employee)})
+        .annotate(**annotations)
+    )
+    for summary_row in summary_rows:
+        rows[summary_row.pop(group_by)].update(summary_row)
+
+
+@timed
+def read_ledgers(rows, employee_ids, start_date, end_date, measures, group_by="eid"):
+    """
+    Fills in rows, a dict of dicts keyed by employee or unit id, with the
+    given measures: one grouped query per ledger involved, then the derived
+    measures. Keys with no ledger rows get zeros.
+    """
+    needed = set()
+    for measure in measures:
+        needed.update(DERIVED_MEASURES.get(measure, (measure,)))
+
+    years = fiscal_year_window(start_date, end_date)
+    if settings.REPORTS_FROM_SUMMARY and years is not None:
+        read_summary(rows, employee_ids, *years, needed, group_by)
+        ledgers = {}
+    else:
+        ledgers = LEDGER_MEASURES
+    for ledger, aggregates in ledgers.items():
+        annotations = {m: agg for m, agg in aggregates.items() if m in needed}
+        if not annotations:
+            continue
+        for row in rows.values():
+            row.update({m: agg.default for m, agg in annotations.items()})
+        ledger_rows = get_ledger(ledger, employee_ids, start_date, end_date, group_by)
+        with span(f"reports.ledger.{ledger}"):
+            for ledger_row in ledger_rows.annotate(**annotations):
+                rows[ledger_row.pop(group_by)].update(ledger_row)
+
+    for row in rows.values():
+        for measure, (first, second) in DERIVED_MEASURES.items():
+            if measure in measures:
+                row[measure] = row[first] + row[second]
     return rows
 
 
+@timed
+def get_report_data(employee_ids, start_date=None, end_date=None, measures=None):
+    """
+    Report kernel shared by the unit, employee type and employee reports.
+
+    Computes the requested measures for each employee in the date window
+    with one grouped query per ledger involved, and returns a list of dicts
+    holding "id" plus each measure (zero when the employee has no rows).
+    """
+    start_date, end_date = check_dates(start_date, end_date)
+    if measures is None:
+        measures = INDIVIDUAL_MEASURES
+    employee_ids = list(employee_ids)
+
+    rows = {eid: {"id": eid} for eid in employee_ids}
+    read_ledgers(rows, employee_ids, start_date, end_date, measures)
+    return [{"id": row["id"], **{m: row[m] for m in measures}} for row in rows.values()]
+
+
+def get_individual_data(employee_ids, start_date=None, end_date=None):
+    return get_report_data(employee_ids, start_date, end_date, INDIVIDUAL_MEASURES)
+
+
+def index_rows(rows):
+    """
+    Materializes report rows once, keyed by id, for merging in memory.
+    """
+    return {row["id"]: row for row in rows}
+
+
+@timed
 def merge_data(rows, data):
+    rows = index_rows(rows)
     for subunit in data["subunits"].values():
         for employee in subunit["employees"].values():
             try:
-                employee.data = rows.get(id=employee.id)
-                employee.data["admin_requested"]
-                employee.data["profdev_requested"]
+                employee.data = rows[employee.id]
                 employee.data["total_requested"] = (
                     employee.data["admin_requested"]
                     + employee.data["profdev_requested"]
@@ -198,7 +341,7 @@ def merge_data(rows, data):
                     employee.data["profdev_days_away"]
                     + employee.data["admin_days_away"]
                 )
-            except ObjectDoesNotExist:
+            except KeyError:
                 employee.data = {
                     "admin_requested": 0,
                     "admin_spent": 0,
@@ -229,6 +372,7 @@ def unit_totals(employees):
     }
 
 
+@timed
 def calculate_totals(data):
     data["unit_totals"] = {
         "admin_requested": 0,
@@ -249,23 +393,64 @@ def calculate_totals(data):
     return data
 
 
+@timed
+def unit_tree_report(unit, start_date=None, end_date=None, measures=None):
+    """
+    Returns every unit in the subtree rooted at unit, in tree order, each
+    annotated with its depth below unit and its "totals": the measures
+    summed over the employees of the unit and all of its subunits.
+
+    Reads each ledger once, grouped by unit, then rolls the per-unit sums
+    up the tree with prefix sums over the nested-set numbering.
+    """
+    start_date, end_date = check_dates(start_date, end_date)
+    if measures is None:
+        measures = UNIT_TREE_MEASURES
+    units = list(unit.subtree().select_related("manager").order_by("lft"))
+    employee_ids = Employee.objects.filter(
+        unit__lft__gte=unit.lft, unit__lft__lte=unit.rgt
+    ).values("id")
+    rows = {u.id: {} for u in units}
+    read_ledgers(rows, employee_ids, start_date, end_date, measures, "unit")
+
+    # prefix[i] holds the sums over units[:i]; since a subtree is a
+    # contiguous run of the lft ordering, its total is a difference of two
+    # prefixes.
+    prefix = [{m: 0 for m in measures}]
+    for u in units:
+        prefix.append({m: prefix[-1][m] + rows[u.id][m] for m in measures})
+    lfts = [u.lft for u in units]
+    open_rgts = []
+    for i, u in enumerate(units):
+        end = bisect_right(lfts, u.rgt)
+        u.totals = {m: prefix[end][m] - prefix[i][m] for m in measures}
+        while open_rgts and open_rgts[-1] < u.lft:
+            open_rgts.pop()
+        u.depth = len(open_rgts)
+        open_rgts.append(u.rgt)
+    return units
+
+
+@timed
 def unit_report(unit, start_date=None, end_date=None):
     data = get_subunits_and_employees(unit)
-    rows = get_individual_data(
-        [e.id for e in unit.all_employees()], start_date, end_date
-    )
+    employee_ids = [
+        eid for subunit in data["subunits"].values() for eid in subunit["employees"]
+    ]
+    rows = get_individual_data(employee_ids, start_date, end_date)
     data = merge_data(rows, data)
     return calculate_totals(data)
 
 
+@timed
 def get_treq_list(fund, start_date=None, end_date=None):
     start_date, end_date = check_dates(start_date, end_date)
     funding_rows = Funding.objects.filter(
-        fund=fund, treq__departure_date__gte=start_date, treq__return_date__lte=end_date
+        treq_in_window(start_date, end_date, "treq__"), fund=fund
     ).values(travel=F("treq"))
 
     actual_expense_rows = ActualExpense.objects.filter(
-        fund=fund, date_paid__gte=start_date, date_paid__lte=end_date
+        paid_in_window(start_date, end_date), fund=fund
     ).values(travel=F("treq"))
     treq_ids = set([e["travel"] for e in funding_rows.union(actual_expense_rows)])
     return treq_ids
@@ -276,10 +461,9 @@ def get_individual_data_for_treq(treq_ids, fund, start_date=None, end_date=None)
 
     profdev_requested = (
         Funding.objects.filter(
+            treq_in_window(start_date, end_date, "treq__"),
             treq=OuterRef("pk"),
             fund=fund,
-            treq__departure_date__gte=start_date,
-            treq__return_date__lte=end_date,
             treq__administrative=False,
         )
         .values("treq__pk")
@@ -289,10 +473,9 @@ def get_individual_data_for_treq(treq_ids, fund, start_date=None, end_date=None)
 
     admin_requested = (
         Funding.objects.filter(
+            treq_in_window(start_date, end_date, "treq__"),
             treq=OuterRef("pk"),
             fund=fund,
-            treq__departure_date__gte=start_date,
-            treq__return_date__lte=end_date,
             treq__administrative=True,
         )
         .values("treq__pk")
@@ -302,9 +485,8 @@ def get_individual_data_for_treq(treq_ids, fund, start_date=None, end_date=None)
 
     profdev_spent = (
         ActualExpense.objects.filter(
+            paid_in_window(start_date, end_date),
             treq=OuterRef("pk"),
-            date_paid__lte=end_date,
-            date_paid__gte=start_date,
             fund=fund,
             treq__administrative=False,
         )
@@ -315,9 +497,8 @@ def get_individual_data_for_treq(treq_ids, fund, start_date=None, end_date=None)
 
     admin_spent = (
         ActualExpense.objects.filter(
+            paid_in_window(start_date, end_date),
             treq=OuterRef("pk"),
-            date_paid__lte=end_date,
-            date_paid__gte=start_date,
             fund=fund,
             treq__administrative=True,
         )
@@ -326,7 +507,8 @@ def get_individual_data_for_treq(treq_ids, fund, start_date=None, end_date=None)
         .values("admin_spent")
     )
 
-    rows = TravelRequest.objects.filter(pk__in=treq_ids).annotate(
+    treqs = TravelRequest.objects.select_related("traveler", "activity")
+    rows = treqs.filter(pk__in=treq_ids).annotate(
         profdev_requested=Coalesce(
             Subquery(
                 profdev_requested.values("profdev_requested"),
@@ -355,6 +537,7 @@ def get_individual_data_for_treq(treq_ids, fund, start_date=None, end_date=None)
     return rows
 
 
+@timed
 def get_fund_employee_list(fund, start_date=None, end_date=None):
     start_date, end_date = check_dates(start_date, end_date)
     rows = Funding.objects.filter(fund=fund).values(eid=F("treq__traveler"))
@@ -368,10 +551,9 @@ def get_individual_data_for_fund(employee_ids, fund, start_date=None, end_date=N
     # 4 subqueries plugged into the final query
     profdev_requested = (
         TravelRequest.objects.filter(
+            treq_in_window(start_date, end_date),
             traveler=OuterRef("pk"),
             administrative=False,
-            departure_date__gte=start_date,
-            return_date__lte=end_date,
             funding__fund=fund,
         )
         .values("traveler__pk")
@@ -390,8 +572,7 @@ def get_individual_data_for_fund(employee_ids, fund, start_date=None, end_date=N
             profdev_spent=Sum(
                 "actualexpense__total",
                 filter=Q(actualexpense__fund=fund)
-                & Q(actualexpense__date_paid__lte=end_date)
-                & Q(actualexpense__date_paid__gte=start_date),
+                & paid_in_window(start_date, end_date, "actualexpense__"),
             )
         )
         .values("profdev_spent")
@@ -399,10 +580,9 @@ def get_individual_data_for_fund(employee_ids, fund, start_date=None, end_date=N
 
     admin_requested = (
         TravelRequest.objects.filter(
+            treq_in_window(start_date, end_date),
             traveler=OuterRef("pk"),
             administrative=True,
-            departure_date__gte=start_date,
-            return_date__lte=end_date,
             funding__fund=fund,
         )
         .values("traveler__pk")
@@ -419,15 +599,15 @@ def get_individual_data_for_fund(employee_ids, fund, start_date=None, end_date=N
             admin_spent=Sum(
                 "actualexpense__total",
                 filter=Q(actualexpense__fund=fund)
-                & Q(actualexpense__date_paid__lte=end_date)
-                & Q(actualexpense__date_paid__gte=start_date),
+                & paid_in_window(start_date, end_date, "actualexpense__"),
             )
         )
         .values("admin_spent")
     )
 
     # final query
-    rows = Employee.objects.filter(pk__in=employee_ids).annotate(
+    employees = Employee.objects.all()
+    rows = employees.filter(pk__in=employee_ids).annotate(
         profdev_requested=Coalesce(
             Subquery(
                 profdev_requested.values("profdev_requested"),
@@ -455,6 +635,7 @@ def get_individual_data_for_fund(employee_ids, fund, start_date=None, end_date=N
     return rows
 
 
+@timed
 def calculate_fund_totals(employees):
     totals = {
         "admin_requested": 0,
@@ -476,12 +657,18 @@ def calculate_fund_totals(employees):
     return employees, totals
 
 
+@timed
 def fund_report(fund, start_date=None, end_date=None):
     eids = get_fund_employee_list(fund, start_date, end_date)
-    employee_data = get_individual_data_for_fund(eids, fund, start_date, end_date)
+    # The query is lazy; time it where it runs.
+    with span("reports.get_individual_data_for_fund"):
+        employee_data = list(
+            get_individual_data_for_fund(eids, fund, start_date, end_date)
+        )
     return calculate_fund_totals(employee_data)
 
 
+@timed
 def get_type_and_employees():
     type_dict = {
         "University Librarian": [],
@@ -491,148 +678,18 @@ def get_type_and_employees():
         "Sr. Exempt Staff": [],
         "Other": [],
     }
-    employees = Employee.objects.order_by("unit")
-    for employee in employees:
+    employees = Employee.objects.select_related("unit__manager")
+    for employee in employees.order_by("unit"):
         if employee.get_type_display() in type_dict:
             type_dict[employee.get_type_display()].append(employee)
 
     return type_dict
 
 
-def get_individual_data_type(employee_ids, start_date=None, end_date=None):
-    profdev_requested = (
-        TravelRequest.objects.filter(
-            traveler=OuterRef("pk"),
-            administrative=False,
-            departure_date__gte=start_date,
-            return_date__lte=end_date,
-        )
-        .values("traveler__pk")
-        .annotate(profdev_requested=Sum("funding__amount"))
-        .values("profdev_requested")
-    )
-
-    profdev_spent = (
-        TravelRequest.objects.filter(traveler=OuterRef("pk"), administrative=False)
-        .values("traveler__pk")
-        .annotate(
-            profdev_spent=Sum(
-                "actualexpense__total",
-                filter=Q(actualexpense__date_paid__lte=end_date)
-                & Q(actualexpense__date_paid__gte=start_date),
-            )
-        )
-        .values("profdev_spent")
-    )
-
-    admin_requested = (
-        TravelRequest.objects.filter(
-            traveler=OuterRef("pk"),
-            administrative=True,
-            departure_date__gte=start_date,
-            return_date__lte=end_date,
-        )
-        .values("traveler__pk")
-        .annotate(admin_requested=Sum("funding__amount"))
-        .values("admin_requested")
-    )
-
-    admin_spent = (
-        TravelRequest.objects.filter(traveler=OuterRef("pk"), administrative=True)
-        .values("traveler__pk")
-        .annotate(
-            admin_spent=Sum(
-                "actualexpense__total",
-                filter=Q(actualexpense__date_paid__lte=end_date)
-                & Q(actualexpense__date_paid__gte=start_date),
-            )
-        )
-        .values("admin_spent")
-    )
-
-    days_vacation = TravelRequest.objects.filter(
-        traveler=OuterRef("pk"),
-        departure_date__gte=start_date,
-        return_date__lte=end_date,
-    ).annotate(days_vacation=Sum("vacation__duration"))
-
-    profdev_days_away = (
-        TravelRequest.objects.filter(
-            traveler=OuterRef("pk"),
-            departure_date__gte=start_date,
-            return_date__lte=end_date,
-            administrative=False,
-            canceled=False,
-        )
-        .values("traveler_id")
-        .annotate(profdev_days_away=Sum("days_ooo"))
-    )
-    admin_days_away = (
-        TravelRequest.objects.filter(
-            traveler=OuterRef("pk"),
-            departure_date__gte=start_date,
-            return_date__lte=end_date,
-            administrative=True,
-            canceled=False,
-        )
-        .values("traveler_id")
-        .annotate(admin_days_away=Sum("days_ooo"))
-    )
-    # final query
-    rows = (
-        Employee.objects.filter(pk__in=employee_ids)
-        .annotate(
-            profdev_requested=Coalesce(
-                Subquery(profdev_requested, output_field=DecimalField()), Decimal(0)
-            ),
-            profdev_spent=Coalesce(
-                Subquery(profdev_spent, output_field=DecimalField()), Decimal(0)
-            ),
-            admin_requested=Coalesce(
-                Subquery(admin_requested, output_field=DecimalField()), Decimal(0)
-            ),
-            admin_spent=Coalesce(
-                Subquery(admin_spent, output_field=DecimalField()), Decimal(0)
-            ),
-            days_vacation=Coalesce(
-                Subquery(
-                    days_vacation.values("days_vacation")[:1],
-                    output_field=IntegerField(),
-                ),
-                Value(0),
-            ),
-            profdev_days_away=Coalesce(
-                Subquery(
-                    profdev_days_away.values("profdev_days_away")[:1],
-                    output_field=IntegerField(),
-                ),
-                Value(0),
-            ),
-            admin_days_away=Coalesce(
-                Subquery(
-                    admin_days_away.values("admin_days_away")[:1],
-                    output_field=IntegerField(),
-                ),
-                Value(0),
-            ),
-        )
-        .values(
-            "id",
-            "profdev_requested",
-            "profdev_spent",
-            "admin_requested",
-            "admin_spent",
-            "days_vacation",
-            "profdev_days_away",
-            "admin_days_away",
-        )
-    )
-    return rows
-
-
+@timed
 def merge_data_type(employee_ids, start_date, end_date):
     type_dict = get_type_and_employees()
-    rows = get_individual_data_type(employee_ids, start_date, end_date)
+    rows = index_rows(get_individual_data(employee_ids, start_date, end_date))
     data = {
         "type": {
             "University Librarian": {"employees": [], "totals": {}},
@@ -648,7 +705,7 @@ def merge_data_type(employee_ids, start_date, end_date):
     for employee_type in type_dict:
         for e in type_dict[employee_type]:
             try:
-                employee = rows.get(id=e.id)
+                employee = rows[e.id]
                 employee["name"] = e.__str__()
                 employee["unit"] = e.unit.__str__()
                 employee["unit_manager"] = e.unit.manager.__str__()
@@ -664,7 +721,7 @@ def merge_data_type(employee_ids, start_date, end_date):
                     employee["profdev_days_away"] + employee["admin_days_away"]
                 )
 
-            except ObjectDoesNotExist:
+            except KeyError:
                 employee = {
                     "admin_requested": 0,
                     "admin_spent": 0,
@@ -746,165 +803,17 @@ def merge_data_type(employee_ids, start_date, end_date):
 
 
 def get_individual_data_employee(employee_ids, start_date=None, end_date=None):
-    start_date, end_date = check_dates(start_date, end_date)
-
-    profdev_requested = (
-        TravelRequest.objects.filter(
-            traveler=OuterRef("pk"),
-            administrative=False,
-            departure_date__gte=start_date,
-            return_date__lte=end_date,
-        )
-        .values("traveler__pk")
-        .annotate(profdev_requested=Sum("funding__amount"))
-        .values("profdev_requested")
-    )
-
-    profdev_spent = (
-        TravelRequest.objects.filter(traveler=OuterRef("pk"), administrative=False)
-        .values("traveler__pk")
-        .annotate(
-            profdev_spent=Sum(
-                "actualexpense__total",
-                filter=Q(actualexpense__date_paid__lte=end_date)
-                & Q(actualexpense__date_paid__gte=start_date),
-            )
-        )
-        .values("profdev_spent")
-    )
-
-    admin_requested = (
-        TravelRequest.objects.filter(
-            traveler=OuterRef("pk"),
-            administrative=True,
-            departure_date__gte=start_date,
-            return_date__lte=end_date,
-        )
-        .values("traveler__pk")
-        .annotate(admin_requested=Sum("funding__amount"))
-        .values("admin_requested")
-    )
-
-    admin_spent = (
-        TravelRequest.objects.filter(traveler=OuterRef("pk"), administrative=True)
-        .values("traveler__pk")
-        .annotate(
-            admin_spent=Sum(
-                "actualexpense__total",
-                filter=Q(actualexpense__date_paid__lte=end_date)
-                & Q(actualexpense__date_paid__gte=start_date),
-            )
-        )
-        .values("admin_spent")
-    )
-
-    profdev_days_away = (
-        TravelRequest.objects.filter(
-            traveler=OuterRef("pk"),
-            administrative=False,
-            departure_date__gte=start_date,
-            return_date__lte=end_date,
-            canceled=False,
-        )
-        .values("traveler_id")
-        .annotate(profdev_days_away=Sum("days_ooo"))
-    )
-    total_requested = (
-        TravelRequest.objects.filter(
-            traveler=OuterRef("pk"),
-            departure_date__gte=start_date,
-            return_date__lte=end_date,
-        )
-        .values("traveler__pk")
-        .annotate(total_requested=Sum("funding__amount"))
-        .values("total_requested")
-    )
-
-    total_spent = (
-        TravelRequest.objects.filter(traveler=OuterRef("pk"))
-        .values("traveler__pk")
-        .annotate(
-            total_spent=Sum(
-                "actualexpense__total",
-                filter=Q(actualexpense__date_paid__lte=end_date)
-                & Q(actualexpense__date_paid__gte=start_date),
-            )
-        )
-        .values("total_spent")
-    )
-
-    admin_days_away = (
-        TravelRequest.objects.filter(
-            traveler=OuterRef("pk"),
-            departure_date__gte=start_date,
-            return_date__lte=end_date,
-            administrative=True,
-            canceled=False,
-        )
-        .values("traveler_id")
-        .annotate(admin_days_away=Sum("days_ooo"))
-    )
-
-    # final query
-
-    rows = (
-        Employee.objects.filter(pk__in=employee_ids)
-        .annotate(
-            profdev_requested=Coalesce(
-                Subquery(profdev_requested, output_field=DecimalField()), Decimal(0)
-            ),
-            profdev_spent=Coalesce(
-                Subquery(profdev_spent, output_field=DecimalField()), Decimal(0)
-            ),
-            admin_requested=Coalesce(
-                Subquery(admin_requested, output_field=DecimalField()), Decimal(0)
-            ),
-            admin_spent=Coalesce(
-                Subquery(admin_spent, output_field=DecimalField()), Decimal(0)
-            ),
-            profdev_days_away=Coalesce(
-                Subquery(
-                    profdev_days_away.values("profdev_days_away")[:1],
-                    output_field=IntegerField(),
-                ),
-                Value(0),
-            ),
-            total_requested=Coalesce(
-                Subquery(total_requested, output_field=DecimalField()), Decimal(0)
-            ),
-            total_spent=Coalesce(
-                Subquery(total_spent, output_field=DecimalField()), Decimal(0)
-            ),
-            admin_days_away=Coalesce(
-                Subquery(
-                    admin_days_away.values("admin_days_away")[:1],
-                    output_field=IntegerField(),
-                ),
-                Value(0),
-            ),
-        )
-        .values(
-            "id",
-            "profdev_requested",
-            "profdev_spent",
-            "admin_requested",
-            "admin_spent",
-            "profdev_days_away",
-            "total_requested",
-            "total_spent",
-            "admin_days_away",
-        )
-    )
-    return rows
+    return get_report_data(employee_ids, start_date, end_date, EMPLOYEE_MEASURES)
 
 
+@timed
 def employee_total_report(employee_ids, start_date, end_date):
     employee_totals = {}
-    rows = get_individual_data_employee(employee_ids, start_date, end_date)
+    rows = index_rows(get_individual_data_employee(employee_ids, start_date, end_date))
 
     for e in employee_ids:
         try:
-            employee = rows.get(id=e)
+            employee = rows[e]
             employee["total_requested"]
             employee["total_spent"]
             employee["total_days_away"] = (
@@ -917,7 +826,7 @@ def employee_total_report(employee_ids, start_date, end_date):
                 profdev_days_cap - employee["profdev_days_away"]
             )
 
-        except ObjectDoesNotExist:
+        except KeyError:
             employee = {
                 "profdev_requested": 0,
                 "profdev_spent": 0,
@@ -935,14 +844,25 @@ def employee_total_report(employee_ids, start_date, end_date):
     return employee_totals
 
 
-def get_individual_data_treq(treq_ids, start_date=None, end_date=None):
+def employee_report(employee, start_date=None, end_date=None):
+    """
+    Returns the employee_total_report totals for a single employee.
+    """
+    return employee_total_report([employee.id], start_date, end_date)[employee.id]
+
+
+def annotate_treq_data(treqs, start_date, end_date):
+    """
+    Annotates a TravelRequest queryset with the amounts and days out that
+    fall in the date window (actualexpenses_fy, funding_fy and days_ooo_fy).
+    """
     actualexpenses_fy = (
         ActualExpense.objects.filter(treq=OuterRef("pk"))
         .values("treq_id")
         .annotate(
             actualexpenses_fy=Sum(
                 "total",
-                filter=Q(date_paid__lte=end_date) & Q(date_paid__gte=start_date),
+                filter=paid_in_window(start_date, end_date),
             )
         )
         .values("actualexpenses_fy")
@@ -953,8 +873,7 @@ def get_individual_data_treq(treq_ids, start_date=None, end_date=None):
         .annotate(
             funding_fy=Sum(
                 "amount",
-                filter=Q(treq__return_date__lte=end_date)
-                & Q(treq__departure_date__gte=start_date),
+                filter=treq_in_window(start_date, end_date, "treq__"),
             )
         )
         .values("funding_fy")
@@ -965,24 +884,48 @@ def get_individual_data_treq(treq_ids, start_date=None, end_date=None):
         .annotate(
             days_ooo_fy=Sum(
                 "days_ooo",
-                filter=Q(return_date__lte=end_date) & Q(departure_date__gte=start_date),
+                filter=treq_in_window(start_date, end_date),
             )
         )
         .values("days_ooo_fy")
     )
 
-    rows = (
-        TravelRequest.objects.filter(pk__in=treq_ids).annotate(
-            actualexpenses_fy=Coalesce(
-                Subquery(actualexpenses_fy, output_field=DecimalField()), Decimal(0)
-            ),
-            funding_fy=Coalesce(
-                Subquery(funding_fy, output_field=DecimalField()), Decimal(0)
-            ),
-            days_ooo_fy=Coalesce(
-                Subquery(days_ooo_fy, output_field=IntegerField()), Value(0)
-            ),
-        )
-    ).values("id", "actualexpenses_fy", "funding_fy", "days_ooo_fy")
+    return treqs.annotate(
+        actualexpenses_fy=Coalesce(
+            Subquery(actualexpenses_fy, output_field=DecimalField()), Decimal(0)
+        ),
+        funding_fy=Coalesce(
+            Subquery(funding_fy, output_field=DecimalField()), Decimal(0)
+        ),
+        days_ooo_fy=Coalesce(
+            Subquery(days_ooo_fy, output_field=IntegerField()), Value(0)
+        ),
+    )
+
 
+def get_individual_data_treq(treq_ids, start_date=None, end_date=None):
+    rows = annotate_treq_data(
+        TravelRequest.objects.filter(pk__in=treq_ids), start_date, end_date
+    )
+    return rows.values("id", "actualexpenses_fy", "funding_fy", "days_ooo_fy")
+
+
+@timed
+def employee_treq_rows(employee, start_date=None, end_date=None):
+    """
+    Returns the employee's travel requests that belong on their report,
+    with activity loaded and window totals annotated, split into
+    "profdev" and "admin" lists. A request belongs on the report if it
+    falls in the window or had expenses paid in it.
+    """
+    start_date, end_date = check_dates(start_date, end_date)
+    treqs = annotate_treq_data(
+        employee.travelrequest_set.select_related("activity"), start_date, end_date
+    )
+    rows = {"profdev": [], "admin": []}
+    for treq in treqs:
+        if treq.actualexpenses_fy != 0 or (
+            treq.departure_date >= start_date and treq.return_date <= end_date
+        ):
+            rows["admin" if treq.administrative else "profdev"].append(treq)
     return rows
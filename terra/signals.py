@@ -0,0 +1,306 @@
+from django.contrib.auth.models import User
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .cache import bump_generations
+from .models import (
+    Unit,
+    UnitClosure,
+    Employee,
+    EmployeeClosure,
+    Fund,
+    TravelRequest,
+    Funding,
+    ActualExpense,
+    Vacation,
+)
+from .summary import apply_contributions, contributions, own_contributions
+from .utils import current_fiscal_year
+
+
+@receiver(pre_save, sender=Unit)
+def keep_unit_numbering(sender, instance, **kwargs):
+    # Renumbering touches every unit, so never write back a stale copy.
+    if instance.pk is not None:
+        numbering = Unit.objects.filter(pk=instance.pk).values_list("lft", "rgt")
+        instance.lft, instance.rgt = numbering.first() or (None, None)
+
+
+@receiver(post_save, sender=Unit)
+def sync_unit_closure(sender, instance, **kwargs):
+    # Unit writes are rare and the tree is small, so any structural change
+    # rebuilds the closure table and the nested-set numbering from scratch.
+    links = dict(
+        UnitClosure.objects.filter(descendant=instance, depth__lte=1).values_list(
+            "depth", "ancestor_id"
+        )
+    )
+    if 0 in links and links.get(1) == instance.parent_unit_id:
+        return
+    UnitClosure.rebuild()
+    Unit.number_tree()
+    instance.lft, instance.rgt = Unit.objects.values_list("lft", "rgt").get(
+        pk=instance.pk
+    )
+
+
+@receiver(pre_save, sender=Employee)
+def set_employee_display_name(sender, instance, **kwargs):
+    # Also runs for fixture loads; an employee loaded before its user is
+    # named when the user is saved.
+    try:
+        instance.display_name = Employee.display_name_for(instance.user)
+    except ObjectDoesNotExist:
+        pass
+
+
+@receiver(post_save, sender=User)
+def sync_employee_display_name(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and {"first_name", "last_name"}.isdisjoint(
+        update_fields
+    ):
+        return
+    name = Employee.display_name_for(instance)
+    Employee.objects.filter(user=instance).exclude(display_name=name).update(
+        display_name=name
+    )
+
+
+@receiver(post_save, sender=Employee)
+def sync_employee_closure(sender, instance, raw=False, **kwargs):
+    if raw:
+        # Fixtures may load a report before their supervisor.
+        EmployeeClosure.rebuild()
+        return
+    links = dict(
+        EmployeeClosure.objects.filter(descendant=instance, depth__lte=1).values_list(
+            "depth", "ancestor_id"
+        )
+    )
+    if 0 in links and links.get(1) == instance.supervisor_id:
+        return
+    EmployeeClosure.attach(instance)
+
+
+@receiver(pre_save, sender=TravelRequest)
+def set_treq_fiscal_years(sender, instance, **kwargs):
+    # Also runs for fixture loads, which bypass Model.save().
+    instance.departure_fiscal_year = current_fiscal_year(today=instance.departure_date)
+    instance.fiscal_year = current_fiscal_year(today=instance.return_date)
+
+
+@receiver(pre_save, sender=ActualExpense)
+def set_expense_fiscal_year(sender, instance, **kwargs):
+    instance.fiscal_year = current_fiscal_year(today=instance.date_paid)
+
+
+@receiver(pre_save, sender=TravelRequest)
+@receiver(pre_save, sender=Funding)
+@receiver(pre_save, sender=ActualExpense)
+@receiver(pre_save, sender=Vacation)
+def remember_previous(sender, instance, raw=False, **kwargs):
+    # Connected before the receivers below, which all compare against the
+    # saved row; fetch it once for them.
+    instance._previous = None
+    if raw or instance.pk is None:
+        return
+    rows = sender.objects.filter(pk=instance.pk)
+    if sender in STORED_TOTALS:
+        # The row's save() holds a transaction; until it commits, a
+        # concurrent edit waits here instead of reading the same old value.
+        rows = rows.select_for_update()
+    instance._previous = rows.first()
+
+
+# The travel request total each kind of row adds its value to.
+STORED_TOTALS = {
+    Funding: ("amount", "funding_total"),
+    ActualExpense: ("total", "expense_total"),
+    Vacation: ("duration", "vacation_days_total"),
+}
+
+
+def add_to_stored_total(sender, treq_id, amount):
+    total = STORED_TOTALS[sender][1]
+    TravelRequest.objects.filter(pk=treq_id).update(**{total: F(total) + amount})
+
+
+@receiver(pre_save, sender=Funding)
+@receiver(pre_save, sender=ActualExpense)
+@receiver(pre_save, sender=Vacation)
+def remember_stored_total(sender, instance, raw=False, **kwargs):
+    instance._stored_total_previous = None
+    previous = instance._previous
+    if not raw and previous is not None:
+        field = STORED_TOTALS[sender][0]
+        instance._stored_total_previous = (previous.treq_id, getattr(previous, field))
+
+
+@receiver(post_save, sender=Funding)
+@receiver(post_save, sender=ActualExpense)
+@receiver(post_save, sender=Vacation)
+def update_stored_total(sender, instance, raw=False, **kwargs):
+    if raw:
+        # Fixtures may already carry the totals, so recount instead.
+        TravelRequest.objects.filter(pk=instance.treq_id).refresh_totals()
+        return
+    amount = getattr(instance, STORED_TOTALS[sender][0])
+    previous = instance._stored_total_previous
+    if previous is not None and previous[0] == instance.treq_id:
+        amount -= previous[1]
+    elif previous is not None:
+        add_to_stored_total(sender, previous[0], -previous[1])
+    if amount:
+        add_to_stored_total(sender, instance.treq_id, amount)
+
+
+@receiver(pre_delete, sender=Funding)
+@receiver(pre_delete, sender=ActualExpense)
+@receiver(pre_delete, sender=Vacation)
+def lock_deleted_total(sender, instance, **kwargs):
+    # Deletes run in the collector's transaction. Subtract what the row
+    # holds now, not a possibly stale copy; nothing if it is already gone.
+    field = STORED_TOTALS[sender][0]
+    rows = sender.objects.select_for_update().filter(pk=instance.pk)
+    instance._stored_total_previous = rows.values_list("treq", field).first()
+
+
+@receiver(post_delete, sender=Funding)
+@receiver(post_delete, sender=ActualExpense)
+@receiver(post_delete, sender=Vacation)
+def remove_from_stored_total(sender, instance, **kwargs):
+    previous = instance._stored_total_previous
+    if previous is not None:
+        add_to_stored_total(sender, previous[0], -previous[1])
+
+
+def ledger_generation_keys(instance):
+    """
+    Returns the report cache generation keys for every (subject, fiscal
+    year) a travel request, funding, expense or vacation row feeds into.
+    """
+    if isinstance(instance, TravelRequest):
+        treq = instance
+        expenses = treq.actualexpense_set.values_list("date_paid", "fund_id")
+        dates = [treq.departure_date, treq.return_date]
+        dates.extend(date_paid for date_paid, fund_id in expenses)
+        funds = {fund_id for date_paid, fund_id in expenses}
+        funds.update(treq.funding_set.values_list("fund_id", flat=True))
+    elif isinstance(instance, ActualExpense):
+        treq = instance.treq
+        dates = [instance.date_paid]
+        funds = {instance.fund_id}
+    else:
+        treq = instance.treq
+        dates = [treq.departure_date, treq.return_date]
+        funds = {instance.fund_id} if isinstance(instance, Funding) else set()
+    units = UnitClosure.objects.filter(descendant__employee=treq.traveler_id)
+    subjects = ["all"]
+    subjects.extend(
+        f"unit:{unit_id}" for unit_id in units.values_list("ancestor_id", flat=True)
+    )
+    subjects.extend(f"fund:{fund_id}" for fund_id in funds)
+    years = {current_fiscal_year(today=d) for d in dates}
+    return [f"gen:{subject}:{year}" for subject in subjects for year in years]
+
+
+def invalidate_reports(keys):
+    bump_generations(keys)
+    # Bump again once the write commits, so that a report computed from the
+    # old rows while the transaction was open is never read back.
+    transaction.on_commit(lambda: bump_generations(keys))
+
+
+# The fields that decide which reports a row feeds into.
+REPORT_FIELDS = {
+    TravelRequest: ("traveler_id", "departure_date", "return_date"),
+    Funding: ("treq_id", "fund_id"),
+    ActualExpense: ("treq_id", "fund_id", "date_paid"),
+    Vacation: ("treq_id",),
+}
+
+
+@receiver(pre_save, sender=TravelRequest)
+@receiver(pre_save, sender=Funding)
+@receiver(pre_save, sender=ActualExpense)
+@receiver(pre_save, sender=Vacation)
+def remember_previous_reports(sender, instance, raw=False, **kwargs):
+    # An edit can move a row out of the reports it used to feed.
+    instance._previous_report_keys = []
+    previous = instance._previous
+    if raw or previous is None:
+        return
+    if any(
+        getattr(previous, field) != getattr(instance, field)
+        for field in REPORT_FIELDS[sender]
+    ):
+        instance._previous_report_keys = ledger_generation_keys(previous)
+
+
+@receiver(post_save, sender=TravelRequest)
+@receiver(post_save, sender=Funding)
+@receiver(post_save, sender=ActualExpense)
+@receiver(post_save, sender=Vacation)
+@receiver(post_delete, sender=TravelRequest)
+@receiver(post_delete, sender=Funding)
+@receiver(post_delete, sender=ActualExpense)
+@receiver(post_delete, sender=Vacation)
+def invalidate_ledger_reports(sender, instance, raw=False, **kwargs):
+    if raw:
+        invalidate_reports(["gen:org"])
+        return
+    try:
+        keys = set(ledger_generation_keys(instance))
+    except ObjectDoesNotExist:
+        # Deleted along with its travel request; it could have fed anything.
+        keys = {"gen:org"}
+    # Only set by the pre_save receiver above, for this save.
+    keys.update(instance.__dict__.pop("_previous_report_keys", []))
+    invalidate_reports(keys)
+
+
+@receiver(post_save, sender=Unit)
+@receiver(post_save, sender=Employee)
+@receiver(post_save, sender=Fund)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=Unit)
+@receiver(post_delete, sender=Employee)
+@receiver(post_delete, sender=Fund)
+def invalidate_org_reports(sender, instance, update_fields=None, **kwargs):
+    # Logging in saves the user's last_login, which no report shows.
+    if update_fields is not None and set(update_fields) == {"last_login"}:
+        return
+    invalidate_reports(["gen:org"])
+
+
+@receiver(pre_save, sender=TravelRequest)
+@receiver(pre_save, sender=Funding)
+@receiver(pre_save, sender=ActualExpense)
+@receiver(pre_save, sender=Vacation)
+def remember_summary_contributions(sender, instance, raw=False, **kwargs):
+    previous = instance._previous
+    if raw and instance.pk is not None:
+        # A fixture may overwrite an existing row.
+        previous = sender.objects.filter(pk=instance.pk).first()
+    instance._summary_previous = [] if previous is None else contributions(previous)
+
+
+@receiver(post_save, sender=TravelRequest)
+@receiver(post_save, sender=Funding)
+@receiver(post_save, sender=ActualExpense)
+@receiver(post_save, sender=Vacation)
+def update_summary(sender, instance, **kwargs):
+    apply_contributions(contributions(instance), instance._summary_previous)
+
+
+@receiver(post_delete, sender=TravelRequest)
+@receiver(post_delete, sender=Funding)
+@receiver(post_delete, sender=ActualExpense)
+@receiver(post_delete, sender=Vacation)
+def remove_from_summary(sender, instance, **kwargs):
+    # A travel request's expenses and vacations are deleted, and subtract
+    # themselves, before it is.
+    apply_contributions([], own_contributions(instance))
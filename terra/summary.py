@@ -0,0 +1,161 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+
+from .models import (
+    EmployeeSummary,
+    TravelRequest,
+    Funding,
+    ActualExpense,
+    Vacation,
+)
+
+# A contribution is (summary key, field, amount), where the summary key is
+# (employee id, start year, end year, administrative).
+
+
+def treq_key(treq):
+    return (
+        treq.traveler_id,
+        treq.departure_fiscal_year,
+        treq.fiscal_year,
+        treq.administrative,
+    )
+
+
+def expense_key(treq, year):
+    return (treq.traveler_id, year, year, treq.administrative)
+
+
+def own_contributions(instance):
+    """
+    Returns what a single travel request, funding, expense or vacation row
+    adds to the summary, leaving out the children of a travel request.
+    """
+    if isinstance(instance, TravelRequest):
+        if instance.canceled:
+            return []
+        return [(treq_key(instance), "days_away", instance.days_ooo)]
+    # The travel request may not be loaded yet when fixtures are; its own
+    # save then counts this row (see treq_contributions).
+    treq = TravelRequest.objects.filter(pk=instance.treq_id).first()
+    if treq is None:
+        return []
+    if isinstance(instance, Funding):
+        return [(treq_key(treq), "requested", instance.amount)]
+    if isinstance(instance, ActualExpense):
+        return [(expense_key(treq, instance.fiscal_year), "spent", instance.total)]
+    if isinstance(instance, Vacation):
+        return [(treq_key(treq), "days_vacation", instance.duration)]
+    raise ValueError(f"Not a summarized model: {instance!r}")
+
+
+def treq_contributions(treq):
+    """
+    Returns what a travel request and all of its funding, expenses and
+    vacations add to the summary; they are all keyed by the request.
+    """
+    key = treq_key(treq)
+    contributions = own_contributions(treq)
+    for amount in Funding.objects.filter(treq=treq.pk).values_list("amount", flat=True):
+        contributions.append((key, "requested", amount))
+    for total, year in ActualExpense.objects.filter(treq=treq.pk).values_list(
+        "total", "fiscal_year"
+    ):
+        contributions.append((expense_key(treq, year), "spent", total))
+    for duration in Vacation.objects.filter(treq=treq.pk).values_list(
+        "duration", flat=True
+    ):
+        contributions.append((key, "days_vacation", duration))
+    return contributions
+
+
+def contributions(instance):
+    if isinstance(instance, TravelRequest):
+        return treq_contributions(instance)
+    return own_contributions(instance)
+
+
+def apply_contributions(added, removed=()):
+    """
+    Adds one set of contributions to the summary and subtracts another,
+    with F() updates so concurrent writers don't lose each other's changes.
+    """
+    deltas = defaultdict(lambda: defaultdict(int))
+    for key, field, amount in added:
+        deltas[key][field] += amount
+    for key, field, amount in removed:
+        deltas[key][field] -= amount
+    for (employee_id, start_year, end_year, administrative), fields in deltas.items():
+        fields = {field: amount for field, amount in fields.items() if amount}
+        if not fields:
+            continue
+        key = {
+            "employee_id": employee_id,
+            "start_year": start_year,
+            "end_year": end_year,
+            "administrative": administrative,
+        }
+        rows = EmployeeSummary.objects.filter(**key)
+        changes = {field: F(field) + amount for field, amount in fields.items()}
+        with transaction.atomic():
+            if rows.update(**changes):
+                continue
+            try:
+                with transaction.atomic():
+                    EmployeeSummary.objects.create(**key, **fields)
+            except IntegrityError:
+                # Another writer created the row first.
+                rows.update(**changes)
+
+
+def rebuild_summary():
+    """
+    Recomputes the whole summary table from the travel data, totalling
+    each ledger in the database.
+    """
+    key_fields = ["traveler", "departure_fiscal_year", "fiscal_year", "administrative"]
+    via_treq = [f"treq__{field}" for field in key_fields]
+    ledgers = [
+        (
+            "days_away",
+            TravelRequest.objects.filter(canceled=False).values_list(*key_fields),
+            "days_ooo",
+        ),
+        ("requested", Funding.objects.values_list(*via_treq), "amount"),
+        ("days_vacation", Vacation.objects.values_list(*via_treq), "duration"),
+    ]
+    totals = defaultdict(lambda: defaultdict(int))
+    for field, rows, amount in ledgers:
+        for *key, total in rows.annotate(Sum(amount)).order_by():
+            totals[tuple(key)][field] += total
+    # Expenses count toward the fiscal year they were paid in.
+    for employee_id, year, administrative, total in (
+        ActualExpense.objects.values_list(
+            "treq__traveler", "fiscal_year", "treq__administrative"
+        )
+        .annotate(Sum("total"))
+        .order_by()
+    ):
+        totals[(employee_id, year, year, administrative)]["spent"] += total
+    with transaction.atomic():
+        EmployeeSummary.objects.all().delete()
+        EmployeeSummary.objects.bulk_create(
+            [
+                EmployeeSummary(
+                    employee_id=employee_id,
+                    start_year=start_year,
+                    end_year=end_year,
+                    administrative=administrative,
+                    **fields,
+                )
+                for (
+                    employee_id,
+                    start_year,
+                    end_year,
+                    administrative,
+                ), fields in totals.items()
+            ],
+            batch_size=1000,
+        )
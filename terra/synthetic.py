@@ -0,0 +1,387 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+from functools import lru_cache, partial
+
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import cache
+from .models import (
+    EXPENSE_TYPES,
+    Activity,
+    ActualExpense,
+    Employee,
+    EmployeeClosure,
+    Fund,
+    Funding,
+    TravelRequest,
+    Unit,
+    UnitClosure,
+    Vacation,
+)
+from .summary import rebuild_summary
+from .utils import current_fiscal_year, fiscal_year_bookends
+
+# Bulk inserts skip model signals, so generate() fills in the fiscal-year
+# columns, employee names and travel request totals itself, and rebuilds
+# the closures, unit numbering and report summary once at the end. The
+# organization is small enough for bulk_create; the travel ledgers are
+# written with insert_rows, which skips building a model instance per row.
+BATCH_SIZE = 1000
+STAFF_TYPES = ["LIBR", "SENR", "OTHR"]
+PREPARED_TYPES = ("DateField", "DateTimeField", "DecimalField")
+
+
+def next_id(model):
+    return (model.objects.aggregate(Max("id"))["id__max"] or 0) + 1
+
+
+def insert_rows(model, fields, rows):
+    """
+    Inserts rows, given as tuples of values for fields, with multi-row
+    INSERT statements. Dates and decimals are converted for the database
+    once per distinct value.
+    """
+    columns = [model._meta.get_field(name) for name in fields]
+    prepare = [
+        (
+            lru_cache(maxsize=None)(
+                partial(field.get_db_prep_save, connection=connection)
+            )
+            if field.get_internal_type() in PREPARED_TYPES
+            else None
+        )
+        for field in columns
+    ]
+    max_params = connection.features.max_query_params or 65535
+    batch = min(BATCH_SIZE, max_params // len(columns))
+    insert = "INSERT INTO {} ({}) VALUES ".format(
+        connection.ops.quote_name(model._meta.db_table),
+        ", ".join(connection.ops.quote_name(field.column) for field in columns),
+    )
+    placeholders = "({})".format(", ".join(["%s"] * len(columns)))
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch):
+            chunk = rows[start : start + batch]
+            cursor.execute(
+                insert + ", ".join([placeholders] * len(chunk)),
+                [p(v) if p else v for row in chunk for p, v in zip(prepare, row)],
+            )
+
+
+def build_units(rng, count, levels):
+    """
+    Creates a library root with count - 1 units beneath it, spread over the
+    given number of levels below the root. Returns the units by level.
+    """
+    root = Unit.objects.create(name="Synthetic Library", type="1")
+    by_level = [[root]]
+    remaining = count - 1
+    for level in range(1, levels + 1):
+        if remaining <= 0:
+            break
+        # Later levels are wider; the last level takes whatever is left.
+        size = remaining if level == levels else max(1, remaining // 2)
+        units = Unit.objects.bulk_create(
+            [
+                Unit(
+                    name=f"Unit {level}.{n}",
+                    type="2" if level == 1 else "3",
+                    parent_unit=rng.choice(by_level[-1]),
+                )
+                for n in range(size)
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        by_level.append(units)
+        remaining -= size
+    return by_level
+
+
+def build_employees(rng, units_by_level, count):
+    """
+    Creates one manager per unit, supervised by the parent unit's manager,
+    and assigns the remaining employees to random units under their
+    unit's manager.
+    """
+    units = [unit for level in units_by_level for unit in level]
+    count = max(count, len(units))
+    # Number people after any existing users so that the generator can be
+    # run more than once against the same database.
+    first = next_id(User)
+    users = User.objects.bulk_create(
+        [
+            User(
+                username=f"synthetic{first + n}",
+                first_name=f"First{first + n}",
+                last_name=f"Last{rng.randrange(count)}",
+            )
+            for n in range(count)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    managers = {}
+    n = 0
+    for level, level_units in enumerate(units_by_level):
+        created = Employee.objects.bulk_create(
+            [
+                Employee(
+                    user=users[n + i],
+                    display_name=Employee.display_name_for(users[n + i]),
+                    uid=f"S{first + n + i:08d}",
+                    unit=unit,
+                    type="ULBR" if level == 0 else "EXEC" if level == 1 else "HEAD",
+                    supervisor=managers.get(unit.parent_unit_id),
+                )
+                for i, unit in enumerate(level_units)
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        for unit, manager in zip(level_units, created):
+            unit.manager = manager
+            managers[unit.id] = manager
+        n += len(level_units)
+    Unit.objects.bulk_update(units, ["manager"], batch_size=BATCH_SIZE)
+    staff = []
+    for i in range(n, count):
+        unit = rng.choice(units)
+        staff.append(
+            Employee(
+                user=users[i],
+                display_name=Employee.display_name_for(users[i]),
+                uid=f"S{first + i:08d}",
+                unit=unit,
+                type=rng.choice(STAFF_TYPES),
+                supervisor=managers[unit.id],
+            )
+        )
+    staff = Employee.objects.bulk_create(staff, batch_size=BATCH_SIZE)
+    return list(managers.values()), staff
+
+
+def build_supervisor_tree(count=5000, fanout=6):
+    """
+    Creates count employees in one unit, each supervising up to fanout
+    others, filled level by level under a single root. Returns the
+    employees by level.
+    """
+    unit = Unit.objects.create(name="Synthetic Supervisor Tree", type="1")
+    first = next_id(User)
+    users = User.objects.bulk_create(
+        [
+            User(username=f"synthetic{first + n}", last_name=f"Last{first + n}")
+            for n in range(count)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    by_level = []
+    supervisors = [None]
+    n = 0
+    while n < count:
+        size = min(count - n, len(supervisors) * fanout if by_level else 1)
+        level = Employee.objects.bulk_create(
+            [
+                Employee(
+                    user=users[n + i],
+                    display_name=Employee.display_name_for(users[n + i]),
+                    uid=f"S{first + n + i:08d}",
+                    unit=unit,
+                    supervisor=supervisors[i // fanout],
+                )
+                for i in range(size)
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        by_level.append(level)
+        supervisors = level
+        n += size
+    EmployeeClosure.rebuild()
+    return by_level
+
+
+def build_treqs(rng, employees, managers, funds, years, count):
+    """
+    Creates count travel requests spread over the fiscal years, with their
+    funding, actual expenses and vacations, and returns the row counts.
+    """
+    activities = Activity.objects.bulk_create(
+        [
+            Activity(
+                name=f"Conference {n}",
+                start=start,
+                end=end,
+                city="Los Angeles",
+                state="CA",
+            )
+            for n, (start, end) in enumerate(
+                fiscal_year_bookends(rng.choice(years))
+                for i in range(max(1, count // 50))
+            )
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    employee_ids = [employee.id for employee in employees]
+    manager_ids = [manager.id for manager in managers]
+    activity_ids = [activity.id for activity in activities]
+    fund_ids = [fund.id for fund in funds]
+    now = timezone.now()
+    treqs, fundings, expenses, vacations = [], [], [], []
+    first_treq = next_id(TravelRequest)
+    funding_id = next_id(Funding)
+    expense_id = next_id(ActualExpense)
+    vacation_id = next_id(Vacation)
+    for treq_id in range(first_treq, first_treq + count):
+        start, end = fiscal_year_bookends(rng.choice(years))
+        departure = start + timedelta(days=rng.randrange((end - start).days))
+        back = departure + timedelta(days=rng.randrange(7))
+        canceled = rng.random() < 0.03
+        treqs.append(
+            (
+                treq_id,
+                rng.choice(employee_ids),
+                rng.choice(activity_ids),
+                departure,
+                back,
+                current_fiscal_year(today=departure),
+                current_fiscal_year(today=back),
+                (back - departure).days + 1,
+                False,
+                rng.random() < 0.2,
+                "",
+                "",
+                canceled,
+                # Totals are filled in once the rows are written.
+                0,
+                0,
+                0,
+            )
+        )
+        treq_funds = rng.sample(fund_ids, min(len(fund_ids), rng.randint(1, 2)))
+        for fund_id in treq_funds:
+            amount = Decimal(rng.randrange(100, 2500))
+            fundings.append(
+                (funding_id, now, rng.choice(manager_ids), treq_id, fund_id, amount, "")
+            )
+            funding_id += 1
+        if canceled:
+            continue
+        for i in range(rng.randint(0, 3)):
+            paid = back + timedelta(days=rng.randrange(60))
+            expenses.append(
+                (
+                    expense_id,
+                    treq_id,
+                    rng.choice(EXPENSE_TYPES)[0],
+                    Decimal(rng.randrange(20, 1200)),
+                    rng.choice(treq_funds),
+                    paid,
+                    current_fiscal_year(today=paid),
+                    False,
+                )
+            )
+            expense_id += 1
+        if rng.random() < 0.1:
+            leave = back + timedelta(days=1)
+            days = rng.randint(1, 5)
+            vacations.append(
+                (vacation_id, treq_id, leave, leave + timedelta(days=days - 1), days)
+            )
+            vacation_id += 1
+
+    insert_rows(
+        TravelRequest,
+        [
+            "id",
+            "traveler",
+            "activity",
+            "departure_date",
+            "return_date",
+            "departure_fiscal_year",
+            "fiscal_year",
+            "days_ooo",
+            "closed",
+            "administrative",
+            "justification",
+            "note",
+            "canceled",
+            "funding_total",
+            "expense_total",
+            "vacation_days_total",
+        ],
+        treqs,
+    )
+    insert_rows(
+        Funding,
+        ["id", "funded_on", "funded_by", "treq", "fund", "amount", "note"],
+        fundings,
+    )
+    insert_rows(
+        ActualExpense,
+        [
+            "id",
+            "treq",
+            "type",
+            "total",
+            "fund",
+            "date_paid",
+            "fiscal_year",
+            "reimbursed",
+        ],
+        expenses,
+    )
+    insert_rows(Vacation, ["id", "treq", "start", "end", "duration"], vacations)
+    TravelRequest.objects.filter(id__gte=first_treq).refresh_totals()
+    # Explicit ids leave PostgreSQL's sequences behind; catch them up.
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(
+            no_style(), [TravelRequest, Funding, ActualExpense, Vacation]
+        ):
+            cursor.execute(sql)
+    return {
+        "treqs": len(treqs),
+        "fundings": len(fundings),
+        "actualexpenses": len(expenses),
+        "vacations": len(vacations),
+    }
+
+
+def generate(units=50, levels=3, employees=500, funds=20, years=3, treqs=5000, seed=0):
+    """
+    Adds a synthetic organization and its travel data to the database and
+    returns the row counts. The same seed always builds the same data.
+    """
+    rng = random.Random(seed)
+    current = current_fiscal_year()
+    fiscal_years = list(range(current - years + 1, current + 1))
+    with transaction.atomic():
+        units_by_level = build_units(rng, units, levels)
+        managers, staff = build_employees(rng, units_by_level, employees)
+        everyone = managers + staff
+        fund_rows = Fund.objects.bulk_create(
+            [
+                Fund(
+                    account=f"{rng.randrange(10**6):06d}",
+                    cost_center=f"{n % 100:02d}",
+                    fund=f"{n:05d}",
+                    manager=rng.choice(managers),
+                    unit=rng.choice(units_by_level[-1]),
+                )
+                for n in range(funds)
+            ]
+        )
+        counts = build_treqs(rng, everyone, managers, fund_rows, fiscal_years, treqs)
+        UnitClosure.rebuild()
+        EmployeeClosure.rebuild()
+        Unit.number_tree()
+        rebuild_summary()
+    cache.bump_generations(["gen:org"])
+    return {
+        "units": sum(len(level) for level in units_by_level),
+        "employees": len(everyone),
+        "funds": len(fund_rows),
+        **counts,
+    }
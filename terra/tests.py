@@ -1,11 +1,22 @@
-from datetime import date
+import ipaddress
+import json
+import os
+import tempfile
+from datetime import date, timedelta
 from decimal import Decimal
-
-from django.test import TestCase
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 
 
-from fiscalyear import FiscalYear
+from fiscalyear import FiscalDate, FiscalYear
+from prometheus_client import REGISTRY
 
 from .models import (
     Unit,
@@ -16,10 +27,21 @@ from .models import (
     Activity,
     Funding,
     ActualExpense,
+    UnitClosure,
+    EmployeeClosure,
+    EmployeeSummary,
 )
+from .middleware import MetricsMiddleware
+from .summary import rebuild_summary
 from .templatetags.terra_extras import check_or_cross, currency, cap, days_cap
-from .utils import current_fiscal_year, in_fiscal_year, fiscal_year
-from terra import reports
+from .utils import (
+    current_fiscal_year,
+    dates_in_fiscal_year,
+    in_fiscal_year,
+    fiscal_year,
+    fiscal_year_bookends,
+)
+from terra import reports, synthetic, timing
 
 
 class ModelsTestCase(TestCase):
@@ -34,6 +56,47 @@ class ModelsTestCase(TestCase):
     def test_unit_super_managers(self):
         u3 = Unit.objects.get(pk=3)
         self.assertEqual(len(u3.super_managers()), 3)
+        u5 = Unit.objects.get(pk=5)
+        with self.assertNumQueries(1):
+            mgrs = u5.super_managers()
+        self.assertEqual([m.id for m in mgrs], [5, 3, 1, 4])
+
+    def test_unit_all_employees(self):
+        expected = set(
+            Employee.objects.filter(unit__in=[2, 3, 5]).values_list("id", flat=True)
+        )
+        diit = Unit.objects.get(pk=2)
+        with self.assertNumQueries(1):
+            team = diit.all_employees()
+        self.assertEqual({e.id for e in team}, expected)
+
+    def test_unit_closure_follows_moves(self):
+        lbs = Unit.objects.get(pk=4)
+        new_unit = Unit.objects.create(name="Payroll", type="3", parent_unit=lbs)
+        self.assertEqual(
+            list(
+                new_unit.ancestor_links.order_by("depth").values_list(
+                    "ancestor_id", flat=True
+                )
+            ),
+            [new_unit.id, 4, 1],
+        )
+        # Moving a unit carries its whole subtree along.
+        u3 = Unit.objects.get(pk=3)
+        u3.parent_unit = lbs
+        u3.save()
+        self.assertTrue(
+            UnitClosure.objects.filter(ancestor_id=4, descendant_id=5, depth=2).exists()
+        )
+        self.assertFalse(
+            UnitClosure.objects.filter(ancestor_id=2, descendant_id=5).exists()
+        )
+        self.assertEqual(
+            sorted(u.id for u in Unit.objects.get(pk=4).subtree()),
+            sorted([3, 4, 5, new_unit.id]),
+        )
+        new_unit.delete()
+        self.assertFalse(UnitClosure.objects.filter(descendant_id=new_unit.id).exists())
 
     def test_employee(self):
         employee = Employee.objects.get(pk=3)
@@ -43,6 +106,34 @@ class ModelsTestCase(TestCase):
         self.assertEqual(employee.type, "HEAD")
         self.assertEqual(employee.extra_allocation, 500.00000)
 
+    def test_employee_display_name(self):
+        # Naming an employee reads the stored column, not the user.
+        employee = Employee.objects.get(pk=3)
+        with self.assertNumQueries(0):
+            self.assertEqual(str(employee), "Gomez, Joshua")
+        user = employee.user
+        user.last_name = "Gómez"
+        user.save()
+        employee.refresh_from_db()
+        self.assertEqual(employee.display_name, "Gómez, Joshua")
+        new_user = User.objects.create_user("newhire", first_name="Ann", last_name="Ng")
+        new = Employee.objects.create(user=new_user, unit_id=1, uid="NEWHIRE")
+        self.assertEqual(Employee.objects.get(pk=new.pk).display_name, "Ng, Ann")
+
+    def test_employee_ordering_skips_user_join(self):
+        sql = str(Employee.objects.all().query)
+        self.assertNotIn("auth_user", sql)
+        names = list(Employee.objects.values_list("display_name", flat=True))
+        self.assertEqual(
+            names,
+            [
+                f"{last}, {first}"
+                for last, first in User.objects.filter(employee__isnull=False)
+                .order_by("last_name", "first_name")
+                .values_list("last_name", "first_name")
+            ],
+        )
+
     def test_employee_direct_reports(self):
         mgr1 = Employee.objects.get(pk=3)
         dr1 = mgr1.direct_reports()
@@ -60,6 +151,31 @@ class ModelsTestCase(TestCase):
         staff, mgrs = sub.full_team()
         self.assertEqual(len(staff), 3)
         self.assertEqual(len(mgrs), 1)
+        with self.assertNumQueries(1):
+            staff, mgrs = head.full_team()
+        self.assertEqual([e.id for e in staff], [4, 1, 3, 5, 2, 6])
+        self.assertEqual([e.id for e in mgrs], [4, 1, 3])
+
+    def test_employee_closure_follows_supervisor_changes(self):
+        emp = Employee.objects.get(pk=3)
+        self.assertEqual([e.id for e in emp.supervisor_chain()], [3, 1, 4])
+        # Moving a supervisor carries their reports along.
+        emp.supervisor = Employee.objects.get(pk=6)
+        emp.save()
+        self.assertEqual(
+            [e.id for e in Employee.objects.get(pk=5).supervisor_chain()],
+            [5, 3, 6, 4],
+        )
+        self.assertEqual(
+            set(Employee.objects.get(pk=1).all_reports().values_list("id", flat=True)),
+            set(),
+        )
+        self.assertEqual(
+            EmployeeClosure.objects.count(),
+            len(
+                EmployeeClosure.objects.values_list("ancestor", "descendant").distinct()
+            ),
+        )
 
     def test_employee_manager_methods(self):
         emp = Employee.objects.get(pk=2)
@@ -173,6 +289,8 @@ class ModelsTestCase(TestCase):
         self.assertEqual(treq.funded(), True)
         a = Funding.objects.get(pk=3)
         a.delete()
+        # The funding total is stored on the request.
+        treq.refresh_from_db()
         self.assertEqual(treq.funded(), False)
 
     def test_treq_in_fiscal_year(self):
@@ -279,6 +397,38 @@ class TestEmpoyeeDetailView(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, "terra/employee.html")
 
+    def test_employee_detail_report_is_scoped(self):
+        self.client.login(username="vsteel", password="Staples50141")
+        response = self.client.get("/employee/2/2020-2020/")
+        report = response.context["report"]
+        self.assertEqual(report["id"], 2)
+        self.assertEqual(report["profdev_spent"], Decimal("1420"))
+        self.assertEqual(report["total_days_away"], 15)
+        profdev = [treq.id for treq in response.context["profdev_treqs"]]
+        self.assertEqual(sorted(profdev), [1, 4, 5])
+        self.assertEqual(response.context["admin_treqs"], [])
+
+    def test_employee_detail_query_count_is_constant(self):
+        self.client.login(username="vsteel", password="Staples50141")
+        with CaptureQueriesContext(connection) as before:
+            self.client.get("/employee/2/2020-2020/")
+        treq = TravelRequest.objects.get(pk=4)
+        for x in range(5):
+            treq.pk = None
+            treq.save()
+        with CaptureQueriesContext(connection) as after:
+            response = self.client.get("/employee/2/2020-2020/")
+        self.assertEqual(len(after), len(before))
+        self.assertEqual(len(response.context["profdev_treqs"]), 8)
+
+    def test_employee_detail_export(self):
+        self.client.login(username="vsteel", password="Staples50141")
+        response = self.client.get("/employee/2/2020-2020/export/")
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn("Professional Development Subtotal,,,,,4000", content)
+        self.assertIn("Total,,,,,4000", content)
+
 
 class TestUnitDetailView(TestCase):
 
@@ -341,6 +491,22 @@ class TestTreqDetailView(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, "terra/treq.html")
 
+    def test_treq_detail_queries(self):
+        # The same fixed set of queries whatever the request's unit depth
+        # or number of fundings and expenses.
+        self.client.login(username="tawopetu", password="Staples50141")
+        for pk in (5, 9):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(f"/treq/{pk}/")
+            self.assertEqual(response.status_code, 200)
+            # Session, user, employee, the request, its unit chain, fundings
+            # and expenses, then the navigation checks in base.html.
+            self.assertEqual(len(queries), 12)
+            treq_queries = [
+                q for q in queries if 'FROM "terra_travelrequest"' in q["sql"]
+            ]
+            self.assertEqual(len(treq_queries), 1)
+
 
 class TestUnitListView(TestCase):
 
@@ -361,6 +527,7 @@ class TestUnitListView(TestCase):
         response = self.client.get("/unit/")
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, "terra/unit_list.html")
+        self.assertEqual(len(response.context["unit_tree"]), 5)
 
 
 # This test case disabled for now; see bug TRRA-195.
@@ -410,6 +577,33 @@ class UtilsTestCase(TestCase):
         self.assertTrue(in_fiscal_year(date(2018, 6, 30), 2018))
         self.assertFalse(in_fiscal_year(date(2018, 6, 30), 2019))
 
+    def test_fiscal_year_bookends(self):
+        for year in (2016, 2020, 2024):
+            fy = FiscalYear(year)
+            self.assertEqual(
+                fiscal_year_bookends(year), (fy.start.date(), fy.end.date())
+            )
+        self.assertEqual(fiscal_year_bookends("2020"), fiscal_year_bookends(2020))
+
+    def test_dates_in_fiscal_year(self):
+        dates = [date(2019, 6, 30), date(2019, 7, 1), date(2020, 6, 30)]
+        self.assertEqual(dates_in_fiscal_year(dates, 2020), [False, True, True])
+        self.assertEqual(dates_in_fiscal_year([], 2020), [])
+
+    def test_matches_fiscalyear_library(self):
+        day = date(2016, 1, 1)
+        while day < date(2021, 1, 1):
+            self.assertEqual(
+                current_fiscal_year(day),
+                FiscalDate(day.year, day.month, day.day).fiscal_year,
+            )
+            day += timedelta(days=1)
+
+    def test_benchmark_fiscal_years(self):
+        out = StringIO()
+        call_command("benchmark_fiscal_years", number=10, stdout=out)
+        self.assertIn("fiscal_year_bookends", out.getvalue())
+
 
 class UnitReportsTestCase(TestCase):
 
@@ -567,6 +761,44 @@ class UnitReportsTestCase(TestCase):
             with self.subTest(key=key, value=value):
                 self.assertEqual(actual["unit_totals"][key], value)
 
+    def test_unit_report_query_count_is_constant(self):
+        library = Unit.objects.get(pk=1)
+        with CaptureQueriesContext(connection) as before:
+            reports.unit_report(library, self.start_date, self.end_date)
+        diit = Unit.objects.get(pk=2)
+        activity = Activity.objects.get(pk=1)
+        fund = Fund.objects.get(pk=1)
+        for x in range(10):
+            u = User.objects.create_user(username=f"extra{x}")
+            e = Employee.objects.create(user=u, uid=f"EXTRA{x:04}", unit=diit)
+            treq = TravelRequest.objects.create(
+                traveler=e,
+                activity=activity,
+                departure_date=date(2019, 10, 1),
+                return_date=date(2019, 10, 3),
+                days_ooo=3,
+            )
+            Funding.objects.create(funded_by=e, treq=treq, fund=fund, amount=100)
+        with CaptureQueriesContext(connection) as after:
+            actual = reports.unit_report(library, self.start_date, self.end_date)
+        self.assertEqual(len(after), len(before))
+        self.assertEqual(
+            actual["subunits"][2]["subunit_totals"]["profdev_requested"],
+            Decimal("7000"),
+        )
+
+    def test_unit_tree_report_matches_unit_report(self):
+        library = Unit.objects.get(pk=1)
+        with self.assertNumQueries(3):
+            tree = reports.unit_tree_report(library, self.start_date, self.end_date)
+        self.assertEqual([u.id for u in tree], [1, 2, 3, 5, 4])
+        self.assertEqual([u.depth for u in tree], [0, 1, 2, 3, 1])
+        for unit in tree:
+            expected = reports.unit_report(unit, self.start_date, self.end_date)
+            for key, value in unit.totals.items():
+                with self.subTest(unit=unit.id, key=key):
+                    self.assertEqual(value, expected["unit_totals"][key])
+
     def test_check_dates_disallows_backward_dates(self):
         self.assertRaises(Exception, reports.check_dates, "2020-01-01", "2019-01-01")
 
@@ -941,6 +1173,26 @@ class EmployeeTypeReportsTestCase(TestCase):
                 actual["type"][employee_type]["employees"],
             )
 
+    def test_type_report_query_count_is_constant(self):
+        employee_ids = list(Employee.objects.values_list("id", flat=True))
+        # Employees with their user, unit and unit manager, then one
+        # query per ledger.
+        with self.assertNumQueries(5):
+            reports.merge_data_type(employee_ids, self.start_date, self.end_date)
+        sdls = Unit.objects.get(pk=3)
+        for x in range(10):
+            u = User.objects.create_user(username=f"extra{x}")
+            e = Employee.objects.create(user=u, uid=f"EXTRA{x:04}", unit=sdls)
+            employee_ids.append(e.id)
+        with self.assertNumQueries(5):
+            actual = reports.merge_data_type(
+                employee_ids, self.start_date, self.end_date
+            )
+        self.assertEqual(len(actual["type"]["Other"]["employees"]), 10)
+        self.assertEqual(
+            actual["type"]["Other"]["employees"][0]["unit_manager"], "Gomez, Joshua"
+        )
+
     def test_type_report_denies_anonymous(self):
         response = self.client.get("/employee_type_list/2020-2020/", follow=True)
         self.assertRedirects(
@@ -991,6 +1243,16 @@ class ReportTestCase(TestCase):
                 with self.subTest(key=key, value=value):
                     self.assertEqual(x[key], expected[key])
 
+    def test_individual_data_is_one_pass_per_table(self):
+        employee_ids = list(Employee.objects.values_list("id", flat=True))
+        start_date = date(2019, 7, 1)
+        end_date = date(2020, 6, 30)
+        # Funding, ActualExpense, TravelRequest and Vacation, regardless of
+        # how many employees are requested.
+        with self.assertNumQueries(4):
+            actual = reports.get_individual_data(employee_ids, start_date, end_date)
+        self.assertEqual(len(actual), len(employee_ids))
+
 
 class EmployeeSubtotalTestCase(TestCase):
 
@@ -1020,6 +1282,21 @@ class EmployeeSubtotalTestCase(TestCase):
                 with self.subTest(key=key, value=value):
                     self.assertEqual(x[key], expected[key])
 
+    def test_report_data_reads_only_needed_ledgers(self):
+        start_date = date(2019, 7, 1)
+        end_date = date(2020, 6, 30)
+        with self.assertNumQueries(1):
+            actual = reports.get_report_data(
+                [2, 3], start_date, end_date, measures=["total_requested"]
+            )
+        self.assertEqual(
+            actual,
+            [
+                {"id": 2, "total_requested": Decimal("4000")},
+                {"id": 3, "total_requested": Decimal("3050")},
+            ],
+        )
+
     def test_employee_total_report(self):
         employee_ids = [2]
         start_date = date(2019, 7, 1)
@@ -1171,3 +1448,761 @@ class OrgChartTestCase(TestCase):
         self.client.login(username="tgrappone", password="Staples50141")
         response = self.client.get("/unit/1/2020-2020/org_export/")
         self.assertEqual(response.status_code, 403)
+
+
+class ReportCacheTestCase(TestCase):
+
+    fixtures = ["sample_data.json"]
+
+    def setUp(self):
+        self.hits = self.lookups("hit")
+        self.misses = self.lookups("miss")
+        self.client.login(username="doriswang", password="Staples50141")
+
+    def lookups(self, result):
+        return REGISTRY.get_sample_value(
+            "terra_report_cache_lookups_total", {"result": result}
+        )
+
+    def get_unit_report(self, unit_id, years="2020-2020"):
+        return self.client.get(f"/unit/{unit_id}/{years}/").context["report"]
+
+    def test_repeat_requests_hit_the_cache(self):
+        first = self.get_unit_report(2)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.get_unit_report(2)
+        self.assertEqual(self.lookups("hit"), self.hits + 1)
+        self.assertEqual(self.lookups("miss"), self.misses + 1)
+        self.assertEqual(second["unit_totals"], first["unit_totals"])
+        self.assertFalse(
+            any("terra_funding" in q["sql"] for q in queries.captured_queries)
+        )
+
+    def test_writes_invalidate_only_affected_reports(self):
+        self.get_unit_report(2)
+        self.get_unit_report(4)
+        treq = TravelRequest.objects.get(pk=4)
+        Funding.objects.create(
+            funded_by=Employee.objects.get(pk=3),
+            treq=treq,
+            fund=Fund.objects.get(pk=1),
+            amount=100,
+        )
+        report = self.get_unit_report(2)
+        self.assertEqual(report["unit_totals"]["profdev_requested"], Decimal("6100"))
+        self.get_unit_report(4)
+        self.assertEqual(self.lookups("hit"), self.hits + 1)
+        self.assertEqual(self.lookups("miss"), self.misses + 3)
+
+    def test_ledger_save_queries(self):
+        funding = Funding.objects.get(pk=1)
+        funding.amount += 1
+        # Each of the five generation keys it feeds is written once, in
+        # five statements on the database cache; the bump repeated on
+        # commit never runs in a TestCase. The save's own transaction adds
+        # a savepoint here.
+        with self.assertNumQueries(37):
+            funding.save()
+
+    def test_moving_a_treq_invalidates_its_old_year(self):
+        before = self.get_unit_report(2)["unit_totals"]["profdev_days_away"]
+        treq = TravelRequest.objects.get(pk=4)
+        treq.departure_date = date(2021, 8, 1)
+        treq.return_date = date(2021, 8, 3)
+        treq.save()
+        after = self.get_unit_report(2)["unit_totals"]["profdev_days_away"]
+        self.assertEqual(after, before - treq.days_ooo)
+
+    def test_fund_report_is_invalidated_by_expenses(self):
+        response = self.client.get("/fund/1/2020-2020/")
+        spent = response.context["totals"]["total_spent"]
+        ActualExpense.objects.create(
+            treq=TravelRequest.objects.get(pk=4),
+            type="OTH",
+            total=50,
+            fund=Fund.objects.get(pk=1),
+            date_paid=date(2020, 1, 15),
+        )
+        response = self.client.get("/fund/1/2020-2020/")
+        self.assertEqual(response.context["totals"]["total_spent"], spent + 50)
+
+
+class EmployeeSummaryTestCase(TestCase):
+
+    fixtures = ["sample_data.json"]
+
+    windows = [(2019, 2019), (2020, 2020), (2019, 2020), (2019, 2021)]
+
+    def summary_rows(self):
+        return sorted(
+            EmployeeSummary.objects.values_list(
+                "employee",
+                "start_year",
+                "end_year",
+                "administrative",
+                "requested",
+                "spent",
+                "days_away",
+                "days_vacation",
+            )
+        )
+
+    def assertSummaryIsCurrent(self):
+        maintained = self.summary_rows()
+        rebuild_summary()
+        self.assertEqual(maintained, self.summary_rows())
+
+    def assertReportsMatchLiveData(self):
+        employee_ids = list(Employee.objects.values_list("id", flat=True))
+        measures = reports.INDIVIDUAL_MEASURES + tuple(reports.DERIVED_MEASURES)
+        library = Unit.objects.get(pk=1)
+        for start_year, end_year in self.windows:
+            start_date = fiscal_year(start_year).start.date()
+            end_date = fiscal_year(end_year).end.date()
+            results = {}
+            for from_summary in (False, True):
+                with self.settings(REPORTS_FROM_SUMMARY=from_summary):
+                    results[from_summary] = (
+                        reports.get_report_data(
+                            employee_ids, start_date, end_date, measures
+                        ),
+                        reports.unit_report(library, start_date, end_date)[
+                            "unit_totals"
+                        ],
+                        [
+                            u.totals
+                            for u in reports.unit_tree_report(
+                                library, start_date, end_date
+                            )
+                        ],
+                        reports.merge_data_type(employee_ids, start_date, end_date)[
+                            "all_type_total"
+                        ],
+                        reports.employee_total_report(
+                            employee_ids, start_date, end_date
+                        ),
+                    )
+            with self.subTest(start_year=start_year, end_year=end_year):
+                self.assertEqual(results[True], results[False])
+
+    def test_fixture_summary_matches_live_data(self):
+        self.assertNotEqual(self.summary_rows(), [])
+        self.assertSummaryIsCurrent()
+        self.assertReportsMatchLiveData()
+
+    def test_summary_follows_writes(self):
+        treq = TravelRequest.objects.get(pk=4)
+        treq.departure_date = date(2020, 6, 28)
+        treq.return_date = date(2020, 7, 2)
+        treq.save()
+        treq = TravelRequest.objects.get(pk=1)
+        treq.administrative = True
+        treq.save()
+        treq = TravelRequest.objects.get(pk=5)
+        treq.canceled = True
+        treq.save()
+        funding = Funding.objects.first()
+        funding.amount += 25
+        funding.save()
+        ActualExpense.objects.first().delete()
+        Vacation.objects.create(
+            treq=TravelRequest.objects.get(pk=4),
+            start=date(2020, 7, 3),
+            end=date(2020, 7, 5),
+        )
+        self.assertSummaryIsCurrent()
+        self.assertReportsMatchLiveData()
+
+    @override_settings(REPORTS_FROM_SUMMARY=True)
+    def test_summary_report_is_one_query(self):
+        fy = fiscal_year(2020)
+        with self.assertNumQueries(1):
+            reports.get_individual_data(
+                [1, 2, 3, 4, 5, 6], fy.start.date(), fy.end.date()
+            )
+
+
+class FiscalYearColumnsTestCase(TestCase):
+
+    fixtures = ["sample_data.json"]
+
+    def test_fixture_columns_match_dates(self):
+        for treq in TravelRequest.objects.all():
+            self.assertEqual(
+                treq.departure_fiscal_year,
+                current_fiscal_year(today=treq.departure_date),
+            )
+            self.assertEqual(
+                treq.fiscal_year, current_fiscal_year(today=treq.return_date)
+            )
+        for expense in ActualExpense.objects.all():
+            self.assertEqual(
+                expense.fiscal_year, current_fiscal_year(today=expense.date_paid)
+            )
+
+    def test_columns_follow_date_changes(self):
+        treq = TravelRequest.objects.get(pk=4)
+        treq.departure_date = date(2020, 6, 28)
+        treq.return_date = date(2020, 7, 2)
+        treq.save()
+        treq.refresh_from_db()
+        self.assertEqual((treq.departure_fiscal_year, treq.fiscal_year), (2020, 2021))
+        self.assertTrue(treq.in_fiscal_year(2021))
+        expense = ActualExpense.objects.get(pk=2)
+        expense.date_paid = date(2021, 7, 1)
+        expense.save()
+        expense.refresh_from_db()
+        self.assertEqual(expense.fiscal_year, 2022)
+
+    def test_helpers_read_dates(self):
+        # Unsaved or edited instances have no up-to-date column yet.
+        treq = TravelRequest(return_date=date(2020, 7, 2))
+        self.assertTrue(treq.in_fiscal_year(2021))
+        self.assertTrue(TravelRequest(return_date=date.today()).in_fiscal_year())
+        expense = ActualExpense.objects.get(pk=2)
+        expense.date_paid = date(2021, 7, 1)
+        self.assertTrue(expense.in_fiscal_year(2022))
+        TravelRequest.objects.filter(pk=1).update(fiscal_year=1999)
+        employee = TravelRequest.objects.get(pk=1).traveler
+        self.assertIn(1, [t.pk for t in employee.treqs_in_fiscal_year(2020)])
+
+    def test_whole_fiscal_years_filter_on_columns(self):
+        fy = fiscal_year(2020)
+        q = reports.treq_in_window(fy.start.date(), fy.end.date())
+        self.assertIn("fiscal_year", str(TravelRequest.objects.filter(q).query))
+        q = reports.treq_in_window(fy.start.date(), date(2020, 3, 31))
+        self.assertIn("return_date", str(TravelRequest.objects.filter(q).query))
+        for start_year, end_year in [(2019, 2019), (2020, 2020), (2019, 2021)]:
+            start_date = fiscal_year(start_year).start.date()
+            end_date = fiscal_year(end_year).end.date()
+            self.assertQuerysetEqual(
+                TravelRequest.objects.filter(
+                    reports.treq_in_window(start_date, end_date)
+                ).order_by("pk"),
+                TravelRequest.objects.filter(
+                    departure_date__gte=start_date, return_date__lte=end_date
+                ).order_by("pk"),
+            )
+            self.assertQuerysetEqual(
+                ActualExpense.objects.filter(
+                    reports.paid_in_window(start_date, end_date)
+                ).order_by("pk"),
+                ActualExpense.objects.filter(
+                    date_paid__range=(start_date, end_date)
+                ).order_by("pk"),
+            )
+
+
+class ExplainReportsTestCase(TestCase):
+
+    fixtures = ["sample_data.json"]
+
+    def index_names(self):
+        with connection.cursor() as cursor:
+            return set(
+                connection.introspection.get_constraints(
+                    cursor, TravelRequest._meta.db_table
+                )
+            )
+
+    def test_explain_rolls_back(self):
+        indexes = self.index_names()
+        self.assertIn("terra_trave_travele_a6bda9_idx", indexes)
+        treqs = TravelRequest.objects.count()
+        out = StringIO()
+        call_command("explain_reports", synthetic=200, fiscal_year=2020, stdout=out)
+        self.assertIn("Without report indexes:", out.getvalue())
+        self.assertIn("terra_trave_travele_a6bda9_idx", out.getvalue())
+        self.assertEqual(self.index_names(), indexes)
+        self.assertEqual(TravelRequest.objects.count(), treqs)
+
+
+class SyntheticDataTestCase(TestCase):
+
+    fixtures = ["sample_data.json"]
+
+    def generated_treqs(self, first_id):
+        return list(
+            TravelRequest.objects.filter(id__gte=first_id)
+            .order_by("id")
+            .values_list("departure_date", "return_date", "administrative")
+        )
+
+    def test_generate_synthetic_data(self):
+        first_id = TravelRequest.objects.latest("id").id + 1
+        out = StringIO()
+        call_command(
+            "generate_synthetic_data",
+            units=8,
+            employees=40,
+            funds=3,
+            treqs=300,
+            seed=7,
+            stdout=out,
+        )
+        self.assertIn("treqs: 300", out.getvalue())
+        generated = self.generated_treqs(first_id)
+        self.assertEqual(len(generated), 300)
+        root = Unit.objects.get(name="Synthetic Library")
+        self.assertEqual(len(root.subtree()), 8)
+        self.assertEqual(
+            Employee.objects.filter(unit__ancestor_links__ancestor=root).count(), 40
+        )
+        self.assertEqual(
+            EmployeeClosure.objects.filter(ancestor=root.manager).count(), 40
+        )
+        for treq in TravelRequest.objects.filter(id__gte=first_id):
+            self.assertEqual(
+                treq.fiscal_year, current_fiscal_year(today=treq.return_date)
+            )
+
+        # Summary-backed reports agree with the live ledgers.
+        start_date = fiscal_year(current_fiscal_year() - 2).start.date()
+        end_date = fiscal_year(current_fiscal_year()).end.date()
+        live = reports.unit_report(root, start_date, end_date)["unit_totals"]
+        with self.settings(REPORTS_FROM_SUMMARY=True):
+            summary = reports.unit_report(root, start_date, end_date)["unit_totals"]
+        self.assertEqual(live, summary)
+        self.assertGreater(live["total_requested"], 0)
+
+        # The same seed generates the same travel again.
+        second_id = TravelRequest.objects.latest("id").id + 1
+        call_command(
+            "generate_synthetic_data",
+            units=8,
+            employees=40,
+            funds=3,
+            treqs=300,
+            seed=7,
+            stdout=StringIO(),
+        )
+        self.assertEqual(self.generated_treqs(second_id), generated)
+
+
+class BenchmarkReportsTestCase(TestCase):
+
+    fixtures = ["sample_data.json"]
+
+    def test_benchmark_and_compare(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            results = os.path.join(tmp, "results.json")
+            call_command(
+                "benchmark_reports",
+                start_year=2020,
+                end_year=2020,
+                iterations=2,
+                output=results,
+                stdout=StringIO(),
+            )
+            with open(results) as f:
+                data = json.load(f)
+            self.assertEqual(data["run"]["treqs"], TravelRequest.objects.count())
+            unit = data["results"]["unit_report"]
+            self.assertGreater(unit["queries"], 0)
+            self.assertLessEqual(unit["p50_ms"], unit["p95_ms"])
+            self.assertIn("view fund_csv", data["results"])
+            # The benchmark user was rolled back.
+            self.assertFalse(User.objects.filter(username="benchmark-reports").exists())
+
+            # A baseline with fewer queries makes the run a regression.
+            data["results"]["unit_report"]["queries"] -= 1
+            baseline = os.path.join(tmp, "baseline.json")
+            with open(baseline, "w") as f:
+                json.dump(data, f)
+            out = StringIO()
+            with self.assertRaises(CommandError):
+                call_command(
+                    "benchmark_reports",
+                    start_year=2020,
+                    end_year=2020,
+                    iterations=1,
+                    case=["unit_report"],
+                    baseline=baseline,
+                    stdout=out,
+                )
+            self.assertIn("unit_report", out.getvalue())
+            self.assertIn("REGRESSION queries", out.getvalue())
+
+    def test_benchmark_supervisor_tree(self):
+        employees = Employee.objects.count()
+        out = StringIO()
+        call_command(
+            "benchmark_supervisor_tree", employees=40, fanout=3, number=1, stdout=out
+        )
+        self.assertIn("40 employees, fanout 3, 4 levels", out.getvalue())
+        # The recursive walk queries once per employee, the closure once.
+        self.assertRegex(
+            out.getvalue(), r"full_team from the root +40 queries .* 1 queries"
+        )
+        self.assertIn("moving a subtree", out.getvalue())
+        self.assertEqual(Employee.objects.count(), employees)
+        with self.assertRaises(CommandError):
+            call_command("benchmark_supervisor_tree", employees=4, fanout=3)
+
+
+class QueryProfilingMiddlewareTestCase(TestCase):
+
+    fixtures = ["sample_data.json"]
+
+    def setUp(self):
+        self.client.login(username="doriswang", password="Staples50141")
+
+    @override_settings(QUERY_PROFILING=True, QUERY_PROFILING_SLOW_MS=0)
+    def test_logs_slow_requests(self):
+        with self.assertLogs("terra.profiling", "WARNING") as logs:
+            response = self.client.get("/unit/1/2020-2020/")
+        self.assertEqual(response.status_code, 200)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["view"], "unit_detail")
+        self.assertNotIn("user", record)
+        self.assertTrue(record["slow"])
+        self.assertGreater(record["queries"], 0)
+        self.assertGreaterEqual(record["ms"], record["db_ms"])
+        # Per-employee queries show up as repeated statements.
+        self.assertTrue(record["duplicates"])
+        self.assertGreater(record["duplicates"][0]["count"], 1)
+
+    @override_settings(
+        QUERY_PROFILING=True,
+        QUERY_PROFILING_SLOW_MS=60 * 1000,
+        QUERY_PROFILING_SAMPLE_RATE=1.0,
+    )
+    def test_samples_other_requests(self):
+        with self.assertLogs("terra.profiling", "INFO") as logs:
+            self.client.get("/unit/")
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(logs.records[0].levelname, "INFO")
+        self.assertFalse(record["slow"])
+
+    @override_settings(
+        QUERY_PROFILING=True,
+        QUERY_PROFILING_SLOW_MS=60 * 1000,
+        QUERY_PROFILING_SAMPLE_RATE=0,
+    )
+    def test_skips_fast_requests(self):
+        with self.assertNoLogs("terra.profiling"):
+            self.client.get("/unit/")
+
+    def test_off_by_default(self):
+        with self.assertNoLogs("terra.profiling"):
+            self.client.get("/unit/")
+
+
+class TimingTestCase(TestCase):
+
+    fixtures = ["sample_data.json"]
+
+    def setUp(self):
+        timing.reset()
+
+    def test_spans_fill_histograms(self):
+        with timing.span("test.block"):
+            pass
+        timing.record("test.block", 30)
+        timing.record("test.block", 20000)
+        (row,) = timing.snapshot()
+        self.assertEqual(row["name"], "test.block")
+        self.assertEqual(row["count"], 3)
+        self.assertEqual(row["counts"][0], 1)
+        self.assertEqual(row["counts"][timing.BUCKETS_MS.index(50)], 1)
+        self.assertEqual(row["counts"][-1], 1)
+        self.assertEqual(row["p50_ms"], 50)
+        self.assertEqual(row["p95_ms"], 20000)
+
+    def test_report_stages_are_timed(self):
+        unit = Unit.objects.get(pk=1)
+        start_date, end_date = fiscal_year_bookends(2020)
+        reports.unit_report(unit, start_date, end_date)
+        names = {row["name"]: row["count"] for row in timing.snapshot()}
+        for stage in (
+            "reports.unit_report",
+            "reports.get_subunits_and_employees",
+            "reports.read_ledgers",
+            "reports.ledger.funding",
+            "reports.merge_data",
+            "reports.calculate_totals",
+        ):
+            self.assertEqual(names[stage], 1, stage)
+
+    def test_lazy_queries_are_timed_where_they_run(self):
+        start_date, end_date = fiscal_year_bookends(2020)
+        fund = Fund.objects.get(pk=1)
+        employees, totals = reports.fund_report(fund, start_date, end_date)
+        names = {row["name"]: row["count"] for row in timing.snapshot()}
+        self.assertEqual(names["reports.get_individual_data_for_fund"], 1)
+        # The rows were fetched inside the span.
+        with self.assertNumQueries(0):
+            list(employees)
+
+    def test_diagnostics_page(self):
+        self.client.login(username="doriswang", password="Staples50141")
+        self.client.get("/unit/1/2020-2020/")
+        response = self.client.get("/diagnostics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "terra/diagnostics.html")
+        self.assertContains(response, "UnitDetailView.get_context_data")
+        self.assertContains(response, "reports.unit_report")
+
+    def test_diagnostics_requires_full_access(self):
+        self.client.login(username="tgrappone", password="Staples50141")
+        response = self.client.get("/diagnostics/")
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(METRICS=True)
+class MetricsTestCase(TestCase):
+
+    fixtures = ["sample_data.json"]
+
+    def sample(self, name, view):
+        return REGISTRY.get_sample_value(name, {"view": view}) or 0
+
+    def test_middleware_counts_requests(self):
+        self.client.login(username="doriswang", password="Staples50141")
+        requests = self.sample("terra_request_duration_seconds_count", "unit_detail")
+        queries = self.sample("terra_sql_queries_total", "unit_detail")
+        exported = self.sample("terra_export_bytes_total", "unit_csv")
+        self.client.get("/unit/1/2020-2020/")
+        response = self.client.get("/unit/1/2020-2020/export/")
+        self.assertEqual(
+            self.sample("terra_request_duration_seconds_count", "unit_detail"),
+            requests + 1,
+        )
+        self.assertGreater(
+            self.sample("terra_sql_queries_total", "unit_detail"), queries
+        )
+        self.assertEqual(
+            self.sample("terra_export_bytes_total", "unit_csv"),
+            exported + len(response.content),
+        )
+
+    def test_middleware_without_content_type(self):
+        def not_modified(request):
+            response = HttpResponse(status=304)
+            del response["Content-Type"]
+            return response
+
+        requests = self.sample("terra_request_duration_seconds_count", "unmatched")
+        middleware = MetricsMiddleware(not_modified)
+        response = middleware(RequestFactory().get("/"))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(
+            self.sample("terra_request_duration_seconds_count", "unmatched"),
+            requests + 1,
+        )
+
+    def test_endpoint(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertContains(response, "# TYPE terra_request_duration_seconds histogram")
+        self.assertContains(response, "# TYPE terra_report_cache_lookups_total counter")
+
+    def test_endpoint_is_local(self):
+        response = self.client.get("/metrics", REMOTE_ADDR="192.0.2.1")
+        self.assertEqual(response.status_code, 403)
+        with self.settings(METRICS_ALLOWED_IPS=[ipaddress.ip_network("192.0.2.0/24")]):
+            response = self.client.get("/metrics", REMOTE_ADDR="192.0.2.1")
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS=False)
+    def test_endpoint_off_by_default(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 404)
+
+
+class AdminChangelistTestCase(TestCase):
+
+    fixtures = ["sample_data.json"]
+
+    @classmethod
+    def setUpTestData(cls):
+        synthetic.generate(units=100, employees=150, funds=4, treqs=150)
+
+    def setUp(self):
+        self.client.login(username="aprigge", password="Staples50141")
+
+    def test_travelrequest_changelist(self):
+        with self.assertNumQueries(7):
+            response = self.client.get("/admin/terra/travelrequest/")
+        self.assertEqual(response.status_code, 200)
+        rows = response.context["cl"].result_list
+        self.assertEqual(len(rows), 100)
+        for treq in rows[:10]:
+            stored = TravelRequest.objects.get(pk=treq.pk)
+            self.assertEqual(treq.funding_total, stored.total_funding())
+            self.assertEqual(treq.expense_total, stored.actual_expenses())
+
+    def test_travelrequest_changelist_sorts_by_totals(self):
+        # Column 11 is the funding total.
+        response = self.client.get("/admin/terra/travelrequest/?o=-11")
+        totals = [treq.funding_total for treq in response.context["cl"].result_list]
+        self.assertEqual(totals, sorted(totals, reverse=True))
+
+    def test_unit_changelist(self):
+        with self.assertNumQueries(6):
+            response = self.client.get("/admin/terra/unit/")
+        rows = response.context["cl"].result_list
+        self.assertEqual(len(rows), 100)
+        for unit in rows:
+            self.assertEqual(unit.employee_total, unit.employee_count())
+
+    def test_employee_changelist(self):
+        with self.assertNumQueries(5):
+            response = self.client.get("/admin/terra/employee/")
+        self.assertEqual(len(response.context["cl"].result_list), 100)
+
+    def test_autocomplete(self):
+        for model, field in [
+            ("travelrequest", "traveler"),
+            ("unit", "manager"),
+            ("unit", "parent_unit"),
+        ]:
+            with self.assertNumQueries(4):
+                response = self.client.get(
+                    "/admin/autocomplete/",
+                    {"app_label": "terra", "model_name": model, "field_name": field},
+                )
+            self.assertEqual(len(response.json()["results"]), 20)
+
+
+class TravelRequestFinancialsTestCase(TestCase):
+
+    fixtures = ["sample_data.json"]
+
+    def test_helpers_read_stored_totals(self):
+        with self.assertNumQueries(1):
+            totals = {
+                treq.pk: (
+                    treq.total_funding(),
+                    treq.approved_funds(),
+                    treq.actual_expenses(),
+                    treq.vacation_days(),
+                    treq.total_days_out(),
+                    treq.funded(),
+                )
+                for treq in TravelRequest.objects.all()
+            }
+        self.assertEqual(len(totals), TravelRequest.objects.count())
+        for treq in TravelRequest.objects.all():
+            funding = sum(f.amount for f in treq.funding_set.all())
+            expenses = sum(e.total for e in treq.actualexpense_set.all())
+            vacation = sum(v.duration for v in treq.vacation_set.all())
+            self.assertEqual(
+                totals[treq.pk],
+                (
+                    funding,
+                    funding,
+                    expenses,
+                    vacation,
+                    treq.days_ooo + vacation,
+                    funding > 0,
+                ),
+            )
+
+
+class StoredTotalsTestCase(TestCase):
+
+    fixtures = ["sample_data.json"]
+
+    def totals(self, pk):
+        treq = TravelRequest.objects.get(pk=pk)
+        return (treq.funding_total, treq.expense_total, treq.vacation_days_total)
+
+    def test_fixture_totals(self):
+        self.assertFalse(TravelRequest.objects.drifted().exists())
+        self.assertEqual(self.totals(1), (Decimal("4000"), Decimal("0"), 5))
+        self.assertEqual(self.totals(9), (Decimal("3500"), Decimal("3230"), 5))
+
+    def test_funding_changes(self):
+        funding = Funding.objects.get(pk=1)
+        funding.amount = Decimal("3000")
+        funding.save()
+        self.assertEqual(self.totals(1)[0], Decimal("3500"))
+        # Moving a row takes it off its old request.
+        funding.treq_id = 9
+        funding.save()
+        self.assertEqual(self.totals(1)[0], Decimal("500"))
+        self.assertEqual(self.totals(9)[0], Decimal("6500"))
+        funding.delete()
+        self.assertEqual(self.totals(9)[0], Decimal("3500"))
+        Funding.objects.create(
+            treq_id=1,
+            fund=Fund.objects.first(),
+            funded_by=Employee.objects.first(),
+            amount=Decimal("250"),
+        )
+        self.assertEqual(self.totals(1)[0], Decimal("750"))
+        self.assertFalse(TravelRequest.objects.drifted().exists())
+
+    def test_expense_and_vacation_changes(self):
+        ActualExpense.objects.create(
+            treq_id=1,
+            type="LDG",
+            total=Decimal("120.50"),
+            fund=Fund.objects.first(),
+            date_paid=date(2019, 10, 1),
+        )
+        vacation = Vacation.objects.get(pk=1)
+        vacation.end = date(2020, 2, 18)
+        vacation.save()
+        self.assertEqual(self.totals(1)[1:], (Decimal("120.50"), 2))
+        ActualExpense.objects.filter(treq=1).get().delete()
+        vacation.delete()
+        self.assertEqual(self.totals(1)[1:], (Decimal("0"), 0))
+        self.assertFalse(TravelRequest.objects.drifted().exists())
+
+    def test_saves_fetch_previous_row_once(self):
+        treq = TravelRequest.objects.get(pk=1)
+        funding = Funding.objects.get(pk=1)
+        for instance, table in (
+            (treq, "terra_travelrequest"),
+            (funding, "terra_funding"),
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                instance.save()
+            selects = [
+                q
+                for q in queries
+                if q["sql"].startswith("SELECT") and f'FROM "{table}"' in q["sql"]
+            ]
+            self.assertEqual(len(selects), 1)
+
+    def test_stale_request_keeps_totals(self):
+        treq = TravelRequest.objects.get(pk=1)
+        Funding.objects.create(
+            treq_id=1,
+            fund=Fund.objects.first(),
+            funded_by=Employee.objects.first(),
+            amount=Decimal("100"),
+        )
+        treq.note = "Updated"
+        treq.save()
+        self.assertEqual(self.totals(1)[0], Decimal("4100"))
+        self.assertEqual(TravelRequest.objects.get(pk=1).note, "Updated")
+        self.assertFalse(TravelRequest.objects.drifted().exists())
+
+    def test_stale_row_deletes_count_once(self):
+        funding = Funding.objects.get(pk=1)
+        stale = Funding.objects.get(pk=1)
+        funding.amount = Decimal("3000")
+        funding.save()
+        stale.delete()
+        self.assertEqual(self.totals(1)[0], Decimal("500"))
+        # Deleting the row again subtracts nothing.
+        funding.delete()
+        self.assertEqual(self.totals(1)[0], Decimal("500"))
+        self.assertFalse(TravelRequest.objects.drifted().exists())
+
+    def test_verify_treq_totals(self):
+        TravelRequest.objects.filter(pk=1).update(funding_total=0)
+        out = StringIO()
+        call_command("verify_treq_totals", stdout=out)
+        self.assertIn("Travel request 1: funding_total is 0", out.getvalue())
+        self.assertIn("1 of 9 travel requests have wrong totals", out.getvalue())
+        self.assertEqual(self.totals(1)[0], Decimal("0"))
+        out = StringIO()
+        call_command("verify_treq_totals", repair=True, stdout=out)
+        self.assertIn("Repaired 1 of 9 travel requests.", out.getvalue())
+        self.assertEqual(self.totals(1)[0], Decimal("4000"))
+        self.assertFalse(TravelRequest.objects.drifted().exists())
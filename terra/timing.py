@@ -0,0 +1,115 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ContextDecorator
+from functools import wraps
+
+# Upper bounds, in milliseconds, of the histogram buckets. Anything slower
+# lands in a final overflow bucket.
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Histograms live in the worker process; each gunicorn worker keeps its own.
+_histograms = {}
+_lock = threading.Lock()
+
+
+class Histogram:
+    """
+    Counts the durations recorded under one span name, by bucket.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms):
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, fraction):
+        """
+        Returns the upper bound of the bucket holding the given fraction of
+        durations; the overflow bucket reports the slowest duration seen.
+        """
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return self.max_ms
+
+
+def record(name, ms):
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.add(ms)
+
+
+class span(ContextDecorator):
+    """
+    Times the enclosed block, or every call of the decorated function, into
+    the named histogram.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, (time.perf_counter() - self.started) * 1000)
+        return False
+
+
+def timed(func):
+    """
+    Decorator timing each call of func under "<module>.<qualified name>",
+    e.g. "reports.unit_report".
+    """
+    name = "{}.{}".format(func.__module__.rpartition(".")[2], func.__qualname__)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record(name, (time.perf_counter() - started) * 1000)
+
+    return wrapper
+
+
+def snapshot():
+    """
+    Returns a summary of each histogram, slowest total first.
+    """
+    with _lock:
+        rows = [
+            {
+                "name": name,
+                "count": h.count,
+                "total_ms": h.total_ms,
+                "mean_ms": h.total_ms / h.count,
+                "p50_ms": h.percentile(0.5),
+                "p95_ms": h.percentile(0.95),
+                "max_ms": h.max_ms,
+                "counts": list(h.counts),
+            }
+            for name, h in _histograms.items()
+        ]
+    return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
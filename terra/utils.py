@@ -1,11 +1,15 @@
-from datetime import date
+from datetime import date, timedelta
+from functools import lru_cache
 from django.conf import settings
 
 import fiscalyear as FY
 import locale
 
-
-FY.START_MONTH = 7
+# Fiscal years start on July 1 and are named for the year they end in, so
+# FY2020 runs from 2019-07-01 to 2020-06-30. The helpers below work on plain
+# integers; the fiscalyear objects are only built for display.
+FISCAL_YEAR_START_MONTH = 7
+FY.START_MONTH = FISCAL_YEAR_START_MONTH
 
 profdev_spending_cap = 3500
 profdev_warning = 2800
@@ -19,12 +23,14 @@ def format_currency(value, grouping=True):
 
 def current_fiscal_year(today=None):
     today = date.today() if today is None else today
-    return FY.FiscalDate(today.year, today.month, today.day).fiscal_year
+    if today.month >= FISCAL_YEAR_START_MONTH:
+        return today.year + 1
+    return today.year
 
 
 def current_fiscal_year_object(today=None):
     year = current_fiscal_year(today=today)
-    return FY.FiscalYear(year)
+    return fiscal_year(year)
 
 
 def current_fiscal_year_int(today=None):
@@ -32,29 +38,44 @@ def current_fiscal_year_int(today=None):
     return year
 
 
+@lru_cache(maxsize=None)
+def _bookends(fiscal_year):
+    start = date(fiscal_year - 1, FISCAL_YEAR_START_MONTH, 1)
+    end = date(fiscal_year, FISCAL_YEAR_START_MONTH, 1) - timedelta(days=1)
+    return (start, end)
+
+
 def fiscal_year_bookends(fiscal_year=None):
     if fiscal_year is None:
         fiscal_year = current_fiscal_year()
-    fy = FY.FiscalYear(fiscal_year)
-    return (fy.start.date(), fy.end.date())
+    return _bookends(int(fiscal_year))
+
+
+@lru_cache(maxsize=None)
+def _fiscal_year(fiscal_year):
+    return FY.FiscalYear(fiscal_year)
 
 
 def fiscal_year(fiscal_year=None):
     if fiscal_year is None:
         fiscal_year = current_fiscal_year()
-    return FY.FiscalYear(fiscal_year)
+    return _fiscal_year(int(fiscal_year))
 
 
 def in_fiscal_year(date, fiscal_year=None):
     if fiscal_year is None:
         fiscal_year = current_fiscal_year()
-    fiscal_date = FY.FiscalDate(date.year, date.month, date.day)
-    return fiscal_date.fiscal_year == fiscal_year
+    return current_fiscal_year(today=date) == fiscal_year
+
+
+def dates_in_fiscal_year(dates, fiscal_year=None):
+    """
+    Returns a list of booleans saying whether each of the dates falls in
+    the fiscal year.
+    """
+    start, end = fiscal_year_bookends(fiscal_year)
+    return [start <= d <= end for d in dates]
 
 
 def fiscal_year_list():
-    current_fiscal_year = current_fiscal_year_int()
-    fiscal_years = []
-    for year in range(settings.INCEPTION_DATE, (current_fiscal_year + 1)):
-        fiscal_years.append(year)
-    return fiscal_years
+    return list(range(settings.INCEPTION_DATE, current_fiscal_year() + 1))
@@ -1,23 +1,51 @@
 import csv
-from django.http import HttpResponseRedirect, HttpResponse
+import ipaddress
+import os
+
+from django.conf import settings
+from django.http import (
+    Http404,
+    HttpResponseForbidden,
+    HttpResponseRedirect,
+    HttpResponse,
+)
+from django.db.models import Prefetch
 from django.urls import reverse
 from django.views.generic.list import ListView
-from django.views.generic import DetailView
+from django.views.generic import DetailView, TemplateView
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.decorators import login_required
-
-from .models import TravelRequest, Unit, Employee, Fund, ActualExpense
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from . import metrics as terra_metrics
+from .cache import cached_report
+from .models import (
+    TravelRequest,
+    Unit,
+    UnitClosure,
+    Employee,
+    Fund,
+    Funding,
+    ActualExpense,
+)
 from .reports import (
     unit_report,
+    unit_tree_report,
     fund_report,
     merge_data_type,
-    employee_total_report,
+    employee_report,
     get_subunits_and_employees,
-    get_individual_data_treq,
+    employee_treq_rows,
     get_treq_list,
     get_individual_data_for_treq,
 )
-from .utils import fiscal_year, current_fiscal_year_int, fiscal_year_list
+from .timing import BUCKETS_MS, snapshot, span, timed
+from .utils import (
+    fiscal_year,
+    fiscal_year_bookends,
+    current_fiscal_year_int,
+    fiscal_year_list,
+)
 
 
 @login_required
@@ -47,6 +75,19 @@ def employee_type_list(request):
     )
 
 
+def metrics(request):
+    """
+    Serves the metrics in the Prometheus text format to the addresses in
+    METRICS_ALLOWED_IPS.
+    """
+    if not settings.METRICS:
+        raise Http404
+    address = ipaddress.ip_address(request.META["REMOTE_ADDR"])
+    if not any(address in network for network in settings.METRICS_ALLOWED_IPS):
+        return HttpResponseForbidden()
+    return HttpResponse(terra_metrics.exposition(), content_type=CONTENT_TYPE_LATEST)
+
+
 class EmployeeDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
 
     model = Employee
@@ -61,6 +102,7 @@ class EmployeeDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
         eligible_users.extend(employee.unit.super_managers())
         return user.employee in eligible_users or user.employee.has_full_report_access()
 
+    @timed
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
 
@@ -68,25 +110,19 @@ class EmployeeDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
         end_fy = fiscal_year(fiscal_year=self.kwargs["end_year"])
         context["start_fy"] = self.kwargs["start_year"]
         context["end_fy"] = self.kwargs["end_year"]
-        id_list = []
-        for employee in Employee.objects.all():
-            id_list.append(employee.id)
-        treq_ids = []
-        for treq in TravelRequest.objects.all():
-            treq_ids.append(treq.id)
-        context["report"] = employee_total_report(
-            employee_ids=id_list,
+        context["report"] = employee_report(
+            employee=self.object,
             start_date=start_fy.start.date(),
             end_date=end_fy.end.date(),
         )
-        context["fy_start"] = start_fy.start.date()
-        context["fy_end"] = end_fy.end.date()
         context["fiscal_year_list"] = fiscal_year_list()
-        context["actualexpenses_fy"] = get_individual_data_treq(
-            treq_ids=treq_ids,
+        treq_rows = employee_treq_rows(
+            employee=self.object,
             start_date=start_fy.start.date(),
             end_date=end_fy.end.date(),
         )
+        context["profdev_treqs"] = treq_rows["profdev"]
+        context["admin_treqs"] = treq_rows["admin"]
         context["fiscalyear"] = "{} - {}".format(start_fy, end_fy)
         return context
 
@@ -95,9 +131,6 @@ class EmployeeDetailExportView(EmployeeDetailView):
     def render_to_response(self, context, **response_kwargs):
         employee = context.get("employee")
         report = context.get("report")
-        actualexpenses_fy = context.get("actualexpenses_fy")
-        fy_start = context.get("fy_start")
-        fy_end = context.get("fy_end")
         start_fy = fiscal_year(fiscal_year=self.kwargs["start_year"])
         end_fy = fiscal_year(fiscal_year=self.kwargs["end_year"])
         response = HttpResponse(content_type="text/csv")
@@ -118,92 +151,74 @@ class EmployeeDetailExportView(EmployeeDetailView):
             ]
         )
         writer.writerow(["Professional Development"])
-        for treq in employee.travelrequest_set.all():
-            for i in actualexpenses_fy:
-                if i["id"] == treq.id:
-                    if treq.administrative == False:
-                        if i["actualexpenses_fy"] != 0 or (
-                            treq.departure_date >= fy_start
-                            and treq.return_date <= fy_end
-                        ):
-                            writer.writerow(
-                                [
-                                    treq.activity.name,
-                                    treq.departure_date,
-                                    treq.return_date,
-                                    treq.closed,
-                                    treq.canceled,
-                                    i["funding_fy"],
-                                    i["actualexpenses_fy"],
-                                    i["days_ooo_fy"],
-                                ]
-                            )
+        for treq in context["profdev_treqs"]:
+            writer.writerow(
+                [
+                    treq.activity.name,
+                    treq.departure_date,
+                    treq.return_date,
+                    treq.closed,
+                    treq.canceled,
+                    treq.funding_fy,
+                    treq.actualexpenses_fy,
+                    treq.days_ooo_fy,
+                ]
+            )
 
         writer.writerow([""])
-        for employee_id, totals in report.items():
-            if employee_id == employee.id:
-                writer.writerow(
-                    [
-                        "Professional Development Subtotal",
-                        "",
-                        "",
-                        "",
-                        "",
-                        totals["profdev_requested"],
-                        totals["profdev_spent"],
-                        totals["profdev_days_away"],
-                    ]
-                )
+        writer.writerow(
+            [
+                "Professional Development Subtotal",
+                "",
+                "",
+                "",
+                "",
+                report["profdev_requested"],
+                report["profdev_spent"],
+                report["profdev_days_away"],
+            ]
+        )
         writer.writerow([""])
         writer.writerow(["Administrative"])
-        for treq in employee.travelrequest_set.all():
-            for i in actualexpenses_fy:
-                if i["id"] == treq.id:
-                    if treq.administrative == True:
-                        if i["actualexpenses_fy"] != 0 or (
-                            treq.departure_date >= fy_start
-                            and treq.return_date <= fy_end
-                        ):
-                            writer.writerow(
-                                [
-                                    treq.activity.name,
-                                    treq.departure_date,
-                                    treq.return_date,
-                                    treq.closed,
-                                    treq.canceled,
-                                    i["funding_fy"],
-                                    i["actualexpenses_fy"],
-                                    i["days_ooo_fy"],
-                                ]
-                            )
+        for treq in context["admin_treqs"]:
+            writer.writerow(
+                [
+                    treq.activity.name,
+                    treq.departure_date,
+                    treq.return_date,
+                    treq.closed,
+                    treq.canceled,
+                    treq.funding_fy,
+                    treq.actualexpenses_fy,
+                    treq.days_ooo_fy,
+                ]
+            )
         writer.writerow([""])
-        for employee_id, totals in report.items():
-            if employee_id == employee.id:
-                writer.writerow(
-                    [
-                        "Administrative Subtotal",
-                        "",
-                        "",
-                        "",
-                        "",
-                        totals["admin_requested"],
-                        totals["admin_spent"],
-                        totals["admin_days_away"],
-                    ]
-                )
-                writer.writerow([""])
-                writer.writerow(
-                    [
-                        "Total",
-                        "",
-                        "",
-                        "",
-                        "",
-                        totals["total_requested"],
-                        totals["total_spent"],
-                        totals["total_days_away"],
-                    ]
-                )
+        writer.writerow(
+            [
+                "Administrative Subtotal",
+                "",
+                "",
+                "",
+                "",
+                report["admin_requested"],
+                report["admin_spent"],
+                report["admin_days_away"],
+            ]
+        )
+        writer.writerow([""])
+        writer.writerow(
+            [
+                "Total",
+                "",
+                "",
+                "",
+                "",
+                report["total_requested"],
+                report["total_spent"],
+                report["total_days_away"],
+            ]
+        )
 
         return response
 
@@ -215,18 +230,46 @@ class TreqDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
     login_url = "/accounts/login/"
     redirect_field_name = "next"
 
+    def get_queryset(self):
+        # Everything the permission check and treq.html read, in one query
+        # plus one per prefetched set.
+        return TravelRequest.objects.select_related(
+            "traveler__unit", "activity", "approved_by"
+        ).prefetch_related(
+            Prefetch(
+                "traveler__unit__ancestor_links",
+                queryset=UnitClosure.objects.select_related("ancestor"),
+            ),
+            Prefetch(
+                "funding_set",
+                queryset=Funding.objects.select_related("fund", "funded_by"),
+            ),
+            Prefetch(
+                "actualexpense_set",
+                queryset=ActualExpense.objects.select_related("fund"),
+            ),
+        )
+
+    def get_object(self, queryset=None):
+        # test_func runs before DetailView.get; both use the same object.
+        if not hasattr(self, "object"):
+            self.object = super().get_object(queryset)
+        return self.object
+
     def test_func(self):
-        user = self.request.user
+        employee = self.request.user.employee
         treq = self.get_object()
 
-        eligible_users = [treq.traveler, treq.traveler.supervisor]
-        eligible_users.extend(treq.traveler.unit.super_managers())
+        eligible_ids = {treq.traveler_id, treq.traveler.supervisor_id}
+        eligible_ids.update(
+            link.ancestor.manager_id for link in treq.traveler.unit.ancestor_links.all()
+        )
         for funding in treq.funding_set.all():
-            eligible_users.append(funding.fund.manager)
+            eligible_ids.add(funding.fund.manager_id)
         for actualexpense in treq.actualexpense_set.all():
-            eligible_users.append(actualexpense.fund.manager)
+            eligible_ids.add(actualexpense.fund.manager_id)
 
-        return user.employee in eligible_users or user.employee.has_full_report_access()
+        return employee.pk in eligible_ids or employee.has_full_report_access()
 
 
 class UnitDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
@@ -242,16 +285,23 @@ class UnitDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
         unit = self.get_object()
         return self.request.user.employee in unit.super_managers()
 
+    @timed
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
         start_fy = fiscal_year(fiscal_year=self.kwargs["start_year"])
         end_fy = fiscal_year(fiscal_year=self.kwargs["end_year"])
         context["start_fy"] = self.kwargs["start_year"]
         context["end_fy"] = self.kwargs["end_year"]
-        context["report"] = unit_report(
-            unit=self.object,
-            start_date=start_fy.start.date(),
-            end_date=end_fy.end.date(),
+        context["report"] = cached_report(
+            "unit",
+            f"unit:{self.object.pk}",
+            self.kwargs["start_year"],
+            self.kwargs["end_year"],
+            lambda: unit_report(
+                unit=self.object,
+                start_date=start_fy.start.date(),
+                end_date=end_fy.end.date(),
+            ),
         )
         context["fiscalyear"] = "{} - {}".format(start_fy, end_fy)
         context["fiscal_year_list"] = fiscal_year_list()
@@ -355,9 +405,16 @@ class UnitListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
             return Unit.objects.filter(type="1")
         return Unit.objects.filter(manager=self.request.user.employee)
 
+    @timed
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
         context["current_fy"] = current_fiscal_year_int()
+        start_date, end_date = fiscal_year_bookends(context["current_fy"])
+        context["unit_tree"] = [
+            node
+            for unit in context["units"]
+            for node in unit_tree_report(unit, start_date, end_date)
+        ]
         return context
 
 
@@ -372,34 +429,52 @@ class FundDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
         if self.request.user.employee.has_full_report_access():
             return True
 
+    @timed
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
         start_fy = fiscal_year(fiscal_year=self.kwargs["start_year"])
         end_fy = fiscal_year(fiscal_year=self.kwargs["end_year"])
         context["start_fy"] = self.kwargs["start_year"]
         context["end_fy"] = self.kwargs["end_year"]
-        context["employees"], context["totals"] = fund_report(
-            fund=self.object,
-            start_date=start_fy.start.date(),
-            end_date=end_fy.end.date(),
-        )
         context["fiscalyear"] = "{} - {}".format(start_fy, end_fy)
         context["fiscal_year_list"] = fiscal_year_list()
-        treq_ids = get_treq_list(
-            fund=self.object,
-            start_date=start_fy.start.date(),
-            end_date=end_fy.end.date(),
-        )
-        context["treq_ids"] = treq_ids
-        context["treq_funds"] = get_individual_data_for_treq(
-            treq_ids=treq_ids,
-            fund=self.object,
-            start_date=start_fy.start.date(),
-            end_date=end_fy.end.date(),
+        context.update(
+            cached_report(
+                "fund",
+                f"fund:{self.object.pk}",
+                self.kwargs["start_year"],
+                self.kwargs["end_year"],
+                lambda: self.fund_context(
+                    start_date=start_fy.start.date(), end_date=end_fy.end.date()
+                ),
+            )
         )
 
         return context
 
+    def fund_context(self, start_date, end_date):
+        employees, totals = fund_report(
+            fund=self.object, start_date=start_date, end_date=end_date
+        )
+        treq_ids = get_treq_list(
+            fund=self.object, start_date=start_date, end_date=end_date
+        )
+        with span("reports.get_individual_data_for_treq"):
+            treq_funds = list(
+                get_individual_data_for_treq(
+                    treq_ids=treq_ids,
+                    fund=self.object,
+                    start_date=start_date,
+                    end_date=end_date,
+                )
+            )
+        return {
+            "employees": list(employees),
+            "totals": totals,
+            "treq_ids": treq_ids,
+            "treq_funds": treq_funds,
+        }
+
 
 class FundExportView(FundDetailView):
     def render_to_response(self, context, **response_kwargs):
@@ -428,7 +503,7 @@ class FundExportView(FundDetailView):
         for e in context["employees"]:
             writer.writerow(
                 [
-                    f"{e.user.last_name}, {e.user.first_name} Total",
+                    f"{e} Total",
                     e.get_type_display(),
                     "",
                     e.profdev_requested,
@@ -443,7 +518,7 @@ class FundExportView(FundDetailView):
                 if e.id == t.traveler.id:
                     writer.writerow(
                         [
-                            f"{e.user.last_name}, {e.user.first_name}",
+                            str(e),
                             "",
                             t.activity,
                             t.profdev_requested,
@@ -486,6 +561,7 @@ class FundListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
             funds = Fund.objects.filter(manager=self.request.user.employee)
         return funds.order_by("unit__name", "account", "cost_center", "fund")
 
+    @timed
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
         context["current_fy"] = current_fiscal_year_int()
@@ -506,19 +582,23 @@ class EmployeeTypeListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
             or self.request.user.employee.is_UL()
         )
 
+    @timed
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
         start_fy = fiscal_year(fiscal_year=self.kwargs["start_year"])
         end_fy = fiscal_year(fiscal_year=self.kwargs["end_year"])
         context["start_fy"] = self.kwargs["start_year"]
         context["end_fy"] = self.kwargs["end_year"]
-        id_list = []
-        for employee in Employee.objects.all():
-            id_list.append(employee.id)
-        context["merge"] = merge_data_type(
-            employee_ids=id_list,
-            start_date=start_fy.start.date(),
-            end_date=end_fy.end.date(),
+        context["merge"] = cached_report(
+            "type",
+            "all",
+            self.kwargs["start_year"],
+            self.kwargs["end_year"],
+            lambda: merge_data_type(
+                employee_ids=Employee.objects.values_list("id", flat=True),
+                start_date=start_fy.start.date(),
+                end_date=end_fy.end.date(),
+            ),
         )
         context["fiscalyear"] = "{} - {}".format(start_fy, end_fy)
         context["fiscal_year_list"] = fiscal_year_list()
@@ -619,6 +699,7 @@ class ActualExpenseListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         if self.request.user.employee.has_full_report_access():
             return True
 
+    @timed
     def get_context_data(self, *args, **kwargs):
 
         context = super().get_context_data(*args, **kwargs)
@@ -628,12 +709,19 @@ class ActualExpenseListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         context["end_fy"] = self.kwargs["end_year"]
         context["report"] = get_subunits_and_employees(Unit.objects.get(pk=1))
         context["actualexpenses"] = ActualExpense.objects.filter(
-            date_paid__gte=start_fy.start.date(), date_paid__lte=end_fy.end.date()
+            fiscal_year__range=(self.kwargs["start_year"], self.kwargs["end_year"])
         )
-        context["unit_totals"] = unit_report(
-            unit=(Unit.objects.get(pk=1)),
-            start_date=start_fy.start.date(),
-            end_date=end_fy.end.date(),
+        # Same report as the library's unit page, so they share a cache entry.
+        context["unit_totals"] = cached_report(
+            "unit",
+            "unit:1",
+            self.kwargs["start_year"],
+            self.kwargs["end_year"],
+            lambda: unit_report(
+                unit=(Unit.objects.get(pk=1)),
+                start_date=start_fy.start.date(),
+                end_date=end_fy.end.date(),
+            ),
         )
         context["fiscalyear"] = "{} - {}".format(start_fy, end_fy)
         context["fiscal_year_list"] = fiscal_year_list()
@@ -787,3 +875,25 @@ class UnitOrgExportView(UnitDetailView):
                 )
 
         return response
+
+
+class DiagnosticsView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    """
+    Shows the report stage timings collected by the worker process that
+    serves the request.
+    """
+
+    login_url = "/accounts/login/"
+    redirect_field_name = "next"
+
+    def test_func(self):
+        return self.request.user.employee.has_full_report_access()
+
+    def get_context_data(self, *args, **kwargs):
+        context = super().get_context_data(*args, **kwargs)
+        context["pid"] = os.getpid()
+        context["buckets"] = [f"≤{bound:g}" for bound in BUCKETS_MS] + [
+            f">{BUCKETS_MS[-1]:g}"
+        ]
+        context["spans"] = snapshot()
+        return context